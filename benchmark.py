@@ -0,0 +1,336 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models'))
+
+from cache import cache_dir_for
+from corpus import WindowCorpus
+from stock import Stock
+from tokenizer import CandleTokenizer
+from universe import Universe
+from utils import join_dataframes
+
+
+# Benchmark scales : num of symbols x num of trading days of 1 minute candles (375 a day)
+SCALES = {'1y'       : {'symbols': 1,   'days': 250},
+          '10y'      : {'symbols': 1,   'days': 2500},
+          '500sym'   : {'symbols': 500, 'days': 20},
+          }
+
+CANDLES_PER_DAY = 375
+
+
+def synthetic_candles(days, seed=0, start='2015-01-01', incomplete_frac=0.02, start_price=1000.0):
+    """
+    NSE style 1 minute candles : weekdays from 9:15 to 15:29 (+05:30), a random walk of 2 decimal prices
+    A fraction of the days closes early, to give Stock incomplete days to find & remove
+
+    Args:
+        days (int): Num of trading days
+        seed (int, optional): Defaults to 0.
+        start (str, optional): First trading day. Defaults to '2015-01-01'.
+        incomplete_frac (float, optional): Fraction of days that close early. Defaults to 0.02.
+        start_price (float, optional): Defaults to 1000.0.
+
+    Returns:
+        df (pandas Dataframe): columns date, open, high, low, close, volume, like the csv files in data/
+    """
+
+    rng = np.random.default_rng(seed)
+
+    dates = pd.bdate_range(start, periods=days)
+    counts = np.full(days, CANDLES_PER_DAY)
+    early = rng.random(days) < incomplete_frac
+    counts[early] = rng.integers(1, CANDLES_PER_DAY, early.sum())
+
+    # Minute of every candle, counted from midnight of its day
+    day_of_candle = np.repeat(np.arange(days), counts)
+    minute_in_day = np.arange(len(day_of_candle)) - np.repeat(np.cumsum(counts) - counts, counts)
+    stamps = dates.as_unit('ns').asi8[day_of_candle] + (555 + minute_in_day) * 60 * 10**9
+
+    close = start_price * np.exp(np.cumsum(rng.normal(0, 0.0008, len(stamps))))
+    open_ = np.r_[start_price, close[:-1]] * np.exp(rng.normal(0, 0.0002, len(stamps)))
+    wicks = np.abs(rng.normal(0, 0.0005, (2, len(stamps)))) * close
+
+    return pd.DataFrame({'date'   : pd.DatetimeIndex(stamps).tz_localize('Asia/Kolkata'),
+                         'open'   : open_.round(2),
+                         'high'   : (np.maximum(open_, close) + wicks[0]).round(2),
+                         'low'    : (np.minimum(open_, close) - wicks[1]).round(2),
+                         'close'  : close.round(2),
+                         'volume' : rng.integers(100, 100_000, len(stamps)),
+                         })
+
+
+def write_dataset(scale, data_dir, seed=0):
+    """
+    Writes the csv files of a scale to <data_dir>/<scale>/, reused if they already exist
+
+    Returns:
+        csv_paths (list)
+    """
+
+    spec = SCALES[scale]
+    scale_dir = os.path.join(data_dir, scale)
+    os.makedirs(scale_dir, exist_ok=True)
+
+    csv_paths = []
+    for i in range(spec['symbols']):
+        csv_path = os.path.join(scale_dir, f'SYM{i:03d}_minute.csv')
+        if not os.path.exists(csv_path):
+            synthetic_candles(spec['days'], seed=seed + i).to_csv(csv_path, index=False)
+        csv_paths.append(csv_path)
+
+    return csv_paths
+
+
+def time_it(fn, repeats, setup=None):
+    """
+    Wall time of <repeats> calls of fn (setup runs untimed before each call)
+
+    Returns:
+        secs (list): one entry per call
+        result : return value of the last call
+    """
+
+    secs = []
+    result = None
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = fn()
+        secs.append(time.perf_counter() - start)
+
+    return secs, result
+
+
+class BenchmarkRun:
+    """
+    Collects the timings of one run, written as JSON to compare across commits
+    """
+
+    def __init__(self, repeats):
+
+        self.repeats = repeats
+        self.results = []
+
+
+    def record(self, scale, name, rows, fn, setup=None, repeats=None):
+        """
+        Times fn & records best / median wall time and rows per second (of the best call)
+        """
+
+        secs, result = time_it(fn, repeats or self.repeats, setup=setup)
+        best = min(secs)
+
+        self.results.append({'scale'        : scale,
+                             'name'         : name,
+                             'rows'         : int(rows),
+                             'repeats'      : len(secs),
+                             'best_secs'    : best,
+                             'median_secs'  : statistics.median(secs),
+                             'rows_per_sec' : rows/best if best > 0 else None,
+                             })
+
+        print(f'{scale:>8} {name:<28} {best*1000:>10.2f} ms {rows/best if best > 0 else 0:>16,.0f} rows/sec')
+
+        return result
+
+
+    def to_json(self, path):
+
+        report = {'meta'    : environment(),
+                  'repeats' : self.repeats,
+                  'results' : self.results,
+                  }
+
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+def environment():
+    """
+    Commit & versions the run was made on
+    """
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {'commit'    : commit,
+            'timestamp' : datetime.datetime.now().isoformat(timespec='seconds'),
+            'python'    : platform.python_version(),
+            'numpy'     : np.__version__,
+            'pandas'    : pd.__version__,
+            'platform'  : platform.platform(),
+            'cpu_count' : os.cpu_count(),
+            }
+
+
+def bench_single(run, scale, csv_path, train=True, epochs=1):
+    """
+    Stock, tokenizer, corpus & training hot paths on one symbol
+    """
+
+    def drop_cache():
+        shutil.rmtree(cache_dir_for(csv_path), ignore_errors=True)
+
+    rows = len(Stock.read_df(csv_path, use_cache=False))
+
+    run.record(scale, 'read_df (csv)', rows, lambda: Stock.read_df(csv_path, use_cache=False))
+    run.record(scale, 'read_df (cold, writes cache)', rows, lambda: Stock.read_df(csv_path), setup=drop_cache)
+    run.record(scale, 'read_df (cached)', rows, lambda: Stock.read_df(csv_path))
+
+    run.record(scale, 'Stock.__init__', rows, lambda: Stock(csv_path))
+
+    # The day table is built by _index_data, _get_incomplete_days only reads it
+    stock = Stock(csv_path, remove_incomplete_days=False)
+    run.record(scale, '_index_data (day table)', rows, stock._index_data)
+    run.record(scale, '_get_incomplete_days', rows, stock._get_incomplete_days)
+
+    # A fresh Stock per call, built untimed
+    fresh = [None]
+    run.record(scale, '_remove_incomplete_days', rows, lambda: fresh[0]._remove_incomplete_days(),
+               setup=lambda: fresh.__setitem__(0, Stock(csv_path, remove_incomplete_days=False)))
+
+    stock = Stock(csv_path)
+    rng = np.random.default_rng(0)
+
+    dates = [datetime.date.fromordinal(d) for d in
+             rng.integers(stock.data.index[0].toordinal(), stock.data.index[-1].toordinal() + 1, 1000)]
+    run.record(scale, 'trading_day_info x1000', len(dates), lambda: [stock.trading_day_info(d) for d in dates])
+
+    targets = stock.data.index[rng.integers(0, len(stock.data), 1000)].tz_localize(None)
+    run.record(scale, 'get_datetime_idx x1000', len(targets), lambda: [stock.get_datetime_idx(t) for t in targets])
+
+    run.record(scale, 'add_additional_features', len(stock.data), stock.add_additional_features)
+
+    # Two overlapping halves, like an old dump & a newer one
+    ohlcv = stock.data[['open', 'high', 'low', 'close', 'volume']]
+    overlap = len(ohlcv) // 10
+    first, second = ohlcv.iloc[: len(ohlcv)//2 + overlap], ohlcv.iloc[len(ohlcv)//2 - overlap :]
+    run.record(scale, 'join_dataframes', len(first) + len(second), lambda: join_dataframes(first, second))
+
+    # train.py : tokenize, window, train
+    tokenizer = CandleTokenizer()
+    raw = stock.data[['open', 'high', 'low', 'close', 'volume']]
+    run.record(scale, 'tokenize', len(raw), lambda: tokenizer.encode(raw))
+
+    corpus = run.record(scale, 'WindowCorpus.from_stock', len(stock.data),
+                        lambda: WindowCorpus.from_stock(stock, tokenizer, window=10))
+
+    corpus_path = os.path.join(tempfile.mkdtemp(prefix='candle2vec-bench-'), 'corpus.txt')
+    try:
+        run.record(scale, 'write_corpus_file', len(corpus), lambda: corpus.write_corpus_file(corpus_path))
+
+        if train:
+            from training import train_word2vec
+
+            run.record(scale, f'train_word2vec ({epochs} epoch)', len(corpus) * epochs,
+                       lambda: train_word2vec(corpus, corpus_path=corpus_path, verbose=False, epochs=epochs,
+                                              vector_size=50, window=5, min_count=1, sg=1),
+                       repeats=1)
+    finally:
+        shutil.rmtree(os.path.dirname(corpus_path), ignore_errors=True)
+
+
+def bench_universe(run, scale, csv_paths, processes=None):
+    """
+    Ingest of many symbols & their aligned panel
+    """
+
+    directory = os.path.dirname(csv_paths[0])
+
+    def drop_caches():
+        for csv_path in csv_paths:
+            shutil.rmtree(cache_dir_for(csv_path), ignore_errors=True)
+
+    universe = run.record(scale, 'Universe (cold)', len(csv_paths),
+                          lambda: Universe(directory, processes=processes), setup=drop_caches, repeats=1)
+    run.record(scale, 'Universe (cached)', len(csv_paths), lambda: Universe(directory, processes=processes))
+
+    rows = len(universe.timestamps) * len(universe.symbols)
+    run.record(scale, 'Universe.panel', rows, lambda: universe.panel('close'))
+
+
+def compare(report_path, baseline_path, threshold):
+    """
+    Prints the change of every benchmark against a baseline report
+
+    Returns:
+        regressions (list): names of the benchmarks more than <threshold> slower than the baseline
+    """
+
+    with open(report_path) as f:
+        current = {(r['scale'], r['name']): r for r in json.load(f)['results']}
+    with open(baseline_path) as f:
+        baseline = {(r['scale'], r['name']): r for r in json.load(f)['results']}
+
+    regressions = []
+    print(f'\nCOMPARED TO {baseline_path}')
+    for key, result in current.items():
+        if key not in baseline:
+            continue
+
+        ratio = result['best_secs'] / baseline[key]['best_secs']
+        flag = ''
+        if ratio > 1 + threshold:
+            regressions.append(f'{key[0]} {key[1]}')
+            flag = '  REGRESSION'
+
+        print(f'{key[0]:>8} {key[1]:<28} {ratio:>8.2f}x{flag}')
+
+    return regressions
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Times the Stock, tokenizer, corpus & training hot paths on synthetic data')
+    parser.add_argument('--scales', nargs='+', default=['1y'], choices=list(SCALES), help='Default : 1y')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'candle2vec-bench'),
+                        help='Where the synthetic csv files are written & reused')
+    parser.add_argument('--output', default='bench_output.json', help='JSON report')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--epochs', type=int, default=1, help='Word2Vec epochs to time')
+    parser.add_argument('--no-train', action='store_true', help='Skip Word2Vec training')
+    parser.add_argument('--processes', type=int, default=None, help='Pool size of the universe ingest')
+    parser.add_argument('--compare', default=None, help='Baseline JSON report to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Slowdown flagged as a regression. Default : 0.2 (20%%)')
+    args = parser.parse_args()
+
+    run = BenchmarkRun(args.repeats)
+
+    for scale in args.scales:
+        csv_paths = write_dataset(scale, args.data_dir)
+
+        if len(csv_paths) == 1:
+            bench_single(run, scale, csv_paths[0], train=not args.no_train, epochs=args.epochs)
+        else:
+            bench_universe(run, scale, csv_paths, processes=args.processes)
+
+    run.to_json(args.output)
+    print(f'\nWritten to {args.output}')
+
+    if args.compare:
+        regressions = compare(args.output, args.compare, args.threshold)
+        if regressions:
+            print(f'\n{len(regressions)} regressions : {regressions}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,9 @@
-from gensim.models import Word2Vec
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models'))
+
+from training import train_word2vec
 
 # Example sequences of price movements (replace with actual sequences)
 sequences = [
@@ -8,8 +13,8 @@ sequences = [
     # Add more sequences here...
 ]
 
-# Initialize and train the Word2Vec model
-model = Word2Vec(sentences=sequences, vector_size=50, window=5, min_count=1, sg=1, workers=4)
+# Initialize and train the Word2Vec model (corpus_file mode, uses every core)
+model, epoch_stats = train_word2vec(sequences, vector_size=50, window=5, min_count=1, sg=1)
 
 # Save the trained model
 model.save("word2vec_ohlc.model")
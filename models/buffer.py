@@ -0,0 +1,145 @@
+import numpy as np
+
+from utils import smallest_int_dtype
+
+
+class ColumnBuffer:
+    """
+    Columns of equal length in preallocated NumPy arrays that grow by doubling, so appending
+    rows is amortized O(rows appended) instead of the O(total rows) copy of pd.concat / np.append
+
+        buffer = ColumnBuffer({'close': closes, 'volume': volumes})
+        buffer.append({'close': [101.5], 'volume': [300]})
+        buffer['close']             # view of the filled rows, no copy
+
+    Views handed out stay valid after later appends, they just don't see the new rows.
+    """
+
+    def __init__(self, columns, capacity=None, growth=2.0):
+        """
+        Args:
+            columns (Dict): column name -> np.ndarray, all of the same length
+            capacity (int, optional): Rows to preallocate. Defaults to None (twice the initial rows, at least 1024).
+            growth (float, optional): Capacity multiplier when the buffer is full. Defaults to 2.0.
+        """
+
+        lengths = {len(values) for values in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError(f'Columns have different lengths {sorted(lengths)}')
+
+        self.length = lengths.pop() if lengths else 0
+        self.capacity = max(capacity or 2*self.length, self.length, 1024)
+        self.growth = growth
+
+        self._arrays = {}
+        for name, values in columns.items():
+            self.add_column(name, values)
+
+
+    def __len__(self):
+
+        return self.length
+
+
+    def __contains__(self, name):
+
+        return name in self._arrays
+
+
+    def __getitem__(self, name):
+
+        return self._arrays[name][:self.length]
+
+
+    @property
+    def columns(self):
+
+        return list(self._arrays)
+
+
+    def views(self):
+        """
+        Dict of column name -> view of the filled rows
+        """
+
+        return {name : array[:self.length] for name, array in self._arrays.items()}
+
+
+    def owns(self, name, values):
+        """
+        True if <values> is (a view of) the storage of column <name>, False if it was replaced since
+        """
+
+        return name in self._arrays and np.may_share_memory(self._arrays[name], values)
+
+
+    def add_column(self, name, values):
+        """
+        Adds or replaces a column, <values> has one entry per filled row
+        """
+
+        values = np.asarray(values)
+        if len(values) != self.length:
+            raise ValueError(f'Column {name!r} has {len(values)} rows, the buffer has {self.length}')
+
+        array = np.empty(self.capacity, dtype=values.dtype)
+        array[:self.length] = values
+        self._arrays[name] = array
+
+
+    def drop_column(self, name):
+
+        del self._arrays[name]
+
+
+    def append(self, columns):
+        """
+        Appends rows, <columns> has the same keys as the buffer
+
+        Integer values that don't fit a column's dtype (Eg. a compact int16 volume) widen the column,
+        anything else is cast to the column's dtype.
+
+        Args:
+            columns (Dict): column name -> array-like of the new rows
+        """
+
+        if set(columns) != set(self._arrays):
+            raise ValueError(f'Rows have columns {sorted(columns)}, the buffer has {sorted(self._arrays)}')
+
+        columns = {name : np.asarray(values) for name, values in columns.items()}
+        num_rows = len(next(iter(columns.values()))) if columns else 0
+        if any(len(values) != num_rows for values in columns.values()):
+            raise ValueError('Appended columns have different lengths')
+
+        if self.length + num_rows > self.capacity:
+            self._grow(self.length + num_rows)
+
+        end = self.length + num_rows
+        for name, values in columns.items():
+            array = self._arrays[name]
+
+            if array.dtype.kind == 'i' and values.dtype.kind in 'iu' and num_rows:
+                info = np.iinfo(array.dtype)
+                low, high = values.min(), values.max()
+                if low < info.min or high > info.max:
+                    array = array.astype(smallest_int_dtype(min(low, array[:self.length].min(initial=0)),
+                                                            max(high, array[:self.length].max(initial=0))))
+                    self._arrays[name] = array
+
+            array[self.length : end] = values
+
+        self.length = end
+
+
+    def _grow(self, min_capacity):
+
+        capacity = self.capacity
+        while capacity < min_capacity:
+            capacity = int(capacity * self.growth) + 1
+
+        for name, array in self._arrays.items():
+            grown = np.empty(capacity, dtype=array.dtype)
+            grown[:self.length] = array[:self.length]
+            self._arrays[name] = grown
+
+        self.capacity = capacity
@@ -0,0 +1,237 @@
+import datetime
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+
+CACHE_VERSION = 1
+CACHE_SUFFIX = '.cache'
+
+
+def cache_dir_for(csv_path):
+    """
+    Returns the directory in which the binary cache of <csv_path> is kept
+    The cache sits next to the csv file, Eg. ./data/NIFTY50_day.csv -> ./data/NIFTY50_day.csv.cache
+
+    Args:
+        csv_path (str): Path to csv file
+
+    Returns:
+        cache_dir (str)
+    """
+
+    return os.fspath(csv_path) + CACHE_SUFFIX
+
+
+def _source_signature(csv_path):
+    """
+    (mtime in nanoseconds, size in bytes) of the source file, used to detect a changed csv
+    """
+
+    stat = os.stat(csv_path)
+
+    return {'source_mtime_ns': stat.st_mtime_ns, 'source_size': stat.st_size}
+
+
+def _tz_to_meta(tz):
+    """
+    Serialises the timezone of the index so that it can be restored on a warm load
+    Fixed offsets (Eg. '+05:30' in the NSE csv files) are stored as seconds, named zones by their name
+    """
+
+    if tz is None:
+        return None
+
+    offset = tz.utcoffset(None)
+    if offset is not None:
+        return {'offset_secs': int(offset.total_seconds())}
+
+    return {'name': getattr(tz, 'key', None) or getattr(tz, 'zone', None) or str(tz)}
+
+
+def _tz_from_meta(meta):
+
+    if meta is None:
+        return None
+
+    if 'offset_secs' in meta:
+        return datetime.timezone(datetime.timedelta(seconds=meta['offset_secs']))
+
+    return meta['name']
+
+
+def is_cache_fresh(csv_path):
+    """
+    Checks if the cache of <csv_path> exists and was built from the current version of the csv
+
+    Args:
+        csv_path (str): Path to csv file
+
+    Returns:
+        fresh (bool)
+    """
+
+    meta_path = os.path.join(cache_dir_for(csv_path), 'meta.json')
+
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+
+    if meta.get('version') != CACHE_VERSION:
+        return False
+
+    signature = _source_signature(csv_path)
+
+    return all(meta.get(key) == value for key, value in signature.items())
+
+
+def write_cache(csv_path, df):
+    """
+    Writes the normalised OHLCV dataframe of <csv_path> as one .npy file per column
+    Timestamps are stored as int64 epoch nanoseconds (UTC), prices & volume with their own dtype
+
+    Args:
+        csv_path (str): Path to the csv file the dataframe was read from
+        df (pandas Dataframe): datetime indexed dataframe returned by Stock.read_df
+    """
+
+    cache_dir = cache_dir_for(csv_path)
+    arrays, meta = arrays_from_frame(df)
+
+    meta = {'version': CACHE_VERSION, **meta}
+    meta.update(_source_signature(csv_path))
+
+    # Build the cache in a temporary directory & swap it in, so readers never see a half written cache
+    tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=os.path.dirname(os.path.abspath(cache_dir)))
+    try:
+        for col, values in arrays.items():
+            np.save(os.path.join(tmp_dir, f'{col}.npy'), values)
+
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+        if os.path.isdir(cache_dir):
+            shutil.rmtree(cache_dir)
+        os.replace(tmp_dir, cache_dir)
+
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+def arrays_from_frame(df):
+    """
+    The columns of a dataframe in the layout of the cache, without writing it
+    Eg. for a csv whose directory is read-only
+
+    Args:
+        df (pandas Dataframe): datetime indexed dataframe returned by Stock.read_df
+
+    Returns:
+        arrays (Dict): column name -> np.ndarray, 'date' holds int64 epoch nanoseconds (UTC)
+        meta (Dict): rows, columns & tz, as in meta.json
+    """
+
+    index = pd.DatetimeIndex(df.index).as_unit('ns')
+
+    arrays = {'date': index.asi8}
+    arrays.update({col: np.ascontiguousarray(df[col].to_numpy()) for col in df.columns})
+
+    meta = {'rows': len(df), 'columns': list(df.columns), 'tz': _tz_to_meta(index.tz)}
+
+    return arrays, meta
+
+
+def load_cache_arrays(csv_path, mmap_mode='r'):
+    """
+    Memory maps the cached columns of <csv_path>, nothing is read into memory until it is used
+
+    Args:
+        csv_path (str): Path to csv file
+        mmap_mode (str, optional): 'r' read-only, 'c' copy-on-write (writes stay in memory, the cache
+                                   is never modified). Defaults to 'r'.
+
+    Returns:
+        arrays (Dict): column name -> np.memmap, 'date' holds int64 epoch nanoseconds (UTC)
+        meta (Dict): contents of meta.json
+    """
+
+    cache_dir = cache_dir_for(csv_path)
+
+    with open(os.path.join(cache_dir, 'meta.json')) as f:
+        meta = json.load(f)
+
+    arrays = {col: np.load(os.path.join(cache_dir, f'{col}.npy'), mmap_mode=mmap_mode)
+              for col in ['date'] + meta['columns']}
+
+    return arrays, meta
+
+
+def index_from_ns(date_ns, meta):
+    """
+    DatetimeIndex over int64 epoch nanoseconds (UTC), in the timezone recorded in <meta>
+
+    Args:
+        date_ns (np.ndarray): int64 epoch nanoseconds
+        meta (Dict): As returned by load_cache_arrays
+
+    Returns:
+        index (pandas DatetimeIndex)
+    """
+
+    index = pd.DatetimeIndex(np.asarray(date_ns).view('M8[ns]'), name='date')
+
+    tz = _tz_from_meta(meta['tz'])
+    if tz is not None:
+        index = index.tz_localize('UTC').tz_convert(tz)
+
+    return index
+
+
+def frame_from_arrays(arrays, meta):
+    """
+    Builds the datetime indexed dataframe over the cached arrays without copying them
+
+    Args:
+        arrays (Dict): As returned by load_cache_arrays
+        meta (Dict): As returned by load_cache_arrays
+
+    Returns:
+        df (pandas Dataframe)
+    """
+
+    index = index_from_ns(arrays['date'], meta)
+
+    # copy=False keeps one block per column, each a view on its memmap
+    df = pd.DataFrame({col: arrays[col] for col in meta['columns']}, index=index, copy=False)
+
+    return df
+
+
+def read_cached_df(csv_path):
+    """
+    Returns the cached dataframe of <csv_path>, or None if the cache is missing or stale
+    The columns are copy-on-write memmaps, so the frame can be edited like a parsed one
+
+    Args:
+        csv_path (str): Path to csv file
+
+    Returns:
+        df (pandas Dataframe or None)
+    """
+
+    if not is_cache_fresh(csv_path):
+        return None
+
+    try:
+        arrays, meta = load_cache_arrays(csv_path, mmap_mode='c')
+    except (OSError, ValueError, KeyError):
+        return None
+
+    return frame_from_arrays(arrays, meta)
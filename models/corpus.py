@@ -0,0 +1,233 @@
+import copy
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from instrument import span
+from resample import NS_PER_DAY, local_ns
+
+
+class WindowCorpus:
+    """
+    Sliding windows over a token id array, produced lazily
+
+    Nothing per window is stored, only the token array and the start position of every window.
+    Windows are read out of a sliding_window_view of the token array (a view, no copy), a chunk at a
+    time, so memory grows with the number of candles and not with candles x window.
+
+    The corpus can be iterated any number of times, so it can be passed straight to gensim :
+
+        corpus = WindowCorpus.from_stock(stock, tokenizer, window=10)
+        model = Word2Vec(sentences=corpus, ...)
+    """
+
+    def __init__(self, token_ids, window=10, stride=1, day_ids=None, token_names=None, chunk_size=65536, candle_ns=None):
+        """
+        Args:
+            token_ids (np.ndarray): Token id of every candle, Eg. CandleTokenizer.encode(stock.data)
+            window (int, optional): Num of candles per window. Defaults to 10.
+            stride (int, optional): Num of candles between window starts. Defaults to 1.
+            day_ids (np.ndarray, optional): Day of every candle (sorted), windows that would cross
+                                            from one day to the next are dropped. Defaults to None.
+            token_names (np.ndarray, optional): token id -> word, iteration yields words if given,
+                                                token ids otherwise. Defaults to None.
+            chunk_size (int, optional): Num of windows materialised at a time. Defaults to 65536.
+            candle_ns (np.ndarray, optional): int64 exchange local nanoseconds of every candle, needed
+                                              to select windows by time (see since). Defaults to None.
+        """
+
+        if window < 1 or stride < 1:
+            raise ValueError(f'window and stride have to be positive, got window={window}, stride={stride}')
+
+        self.token_ids = np.asarray(token_ids)
+        self.window = window
+        self.stride = stride
+        self.token_names = None if token_names is None else np.asarray(token_names)
+        self.chunk_size = chunk_size
+        self.candle_ns = None if candle_ns is None else np.asarray(candle_ns)
+
+        self.starts = self._window_starts(day_ids)      # Position of the first candle of every window
+
+
+    @classmethod
+    def from_stock(cls, stock, tokenizer, window=10, stride=1, cross_days=False, timeframe=None, **kwargs):
+        """
+        Corpus of a Stock's candles, tokenized with <tokenizer> (a CandleTokenizer)
+
+        Args:
+            stock (Stock)
+            tokenizer (CandleTokenizer)
+            window (int, optional): Num of candles per window. Defaults to 10.
+            stride (int, optional): Num of candles between window starts. Defaults to 1.
+            cross_days (bool, optional): Allow windows that span two sessions, always the case for day candles.
+                                         Defaults to False.
+            timeframe (int or str, optional): Tokenize the cached bars of Stock.resample(timeframe)
+                                              instead of the candles. Defaults to None.
+        """
+
+        if timeframe is None:
+            data = stock.data
+            candle_ns = stock._index_ns
+            # A day candle is a whole session, windows of them span days
+            day_ids = np.repeat(stock.day_keys, stock.day_counts) if stock.cdst_duration_days is None else None
+        else:
+            data = stock.resample(timeframe)
+            candle_ns = local_ns(data.index)
+            day_ids = candle_ns // NS_PER_DAY if timeframe != 'day' else None
+
+        with span('corpus.tokenize', rows=len(data)):
+            token_ids = tokenizer.encode(data)
+
+        return cls(token_ids, window=window, stride=stride, day_ids=None if cross_days else day_ids,
+                   token_names=tokenizer.token_names, candle_ns=candle_ns, **kwargs)
+
+
+    def __len__(self):
+
+        return len(self.starts)
+
+
+    def __iter__(self):
+        """
+        Yields every window as a list (of words if token_names was given, else of token ids)
+        """
+
+        for chunk in self.iter_chunks():
+            if self.token_names is not None:
+                chunk = self.token_names[chunk]
+            yield from chunk.tolist()
+
+
+    def iter_chunks(self, chunk_size=None):
+        """
+        Yields the windows as 2D token id arrays (num windows, window) of at most chunk_size rows
+        Without day boundaries & with stride 1 the chunks are views on the token array
+        """
+
+        chunk_size = chunk_size or self.chunk_size
+        windows = self.windows_view()
+
+        for begin in range(0, len(self.starts), chunk_size):
+            starts = self.starts[begin : begin + chunk_size]
+
+            # Regularly spaced starts are a slice of the view, anything else needs a (chunk sized) gather
+            if len(starts) == 1 or np.all(np.diff(starts) == self.stride):
+                yield windows[starts[0] : starts[-1] + 1 : self.stride]
+            else:
+                yield windows[starts]
+
+
+    def write_corpus_file(self, path):
+        """
+        Writes the corpus as a whitespace delimited text file, one window per line, a chunk at a time
+        This is the input format of gensim's corpus_file mode (see models/training.py)
+
+        Args:
+            path (str): Output file
+
+        Returns:
+            num_words (int): Total num of tokens written
+        """
+
+        return write_corpus_file(self.iter_chunks(), path, token_names=self.token_names)
+
+
+    def subset(self, selection):
+        """
+        Corpus of some of the windows, sharing the token array
+
+        Args:
+            selection (np.ndarray): bool mask over the windows, or window numbers
+
+        Returns:
+            corpus (WindowCorpus)
+        """
+
+        corpus = copy.copy(self)
+        corpus.starts = self.starts[selection]
+
+        return corpus
+
+
+    def window_end_ns(self):
+        """
+        Local nanoseconds of the last candle of every window
+        """
+
+        if self.candle_ns is None:
+            raise ValueError('The corpus has no candle times, build it with WindowCorpus.from_stock or pass candle_ns')
+
+        return self.candle_ns[self.starts + self.window - 1]
+
+
+    def since(self, after_ns):
+        """
+        Windows whose last candle is after <after_ns> (local nanoseconds), Eg. the windows a model has not seen
+        """
+
+        return self.subset(self.window_end_ns() > after_ns)
+
+
+    def windows_view(self):
+        """
+        (num candles - window + 1, window) view on the token array, row i is the window starting at candle i
+        """
+
+        if len(self.token_ids) < self.window:
+            return np.empty((0, self.window), dtype=self.token_ids.dtype)
+
+        return sliding_window_view(self.token_ids, self.window)
+
+
+    def _window_starts(self, day_ids):
+
+        num_windows = len(self.token_ids) - self.window + 1
+        if num_windows <= 0:
+            return np.empty(0, dtype=np.int64)
+
+        if day_ids is None:
+            return np.arange(0, num_windows, self.stride, dtype=np.int64)
+
+        day_ids = np.asarray(day_ids)
+        starts = np.arange(num_windows, dtype=np.int64)
+
+        # A window stays within a day if its first and last candle are on the same day
+        same_day = day_ids[:num_windows] == day_ids[self.window - 1:]
+
+        # Strides are counted from the first candle of each day
+        day_first = np.flatnonzero(np.diff(day_ids, prepend=day_ids[:1] - 1) != 0)
+        offset_in_day = starts - day_first[np.searchsorted(day_first, starts, side='right') - 1]
+
+        return starts[same_day & (offset_in_day % self.stride == 0)]
+
+
+def write_corpus_file(sentences, path, token_names=None):
+    """
+    Writes sentences as a whitespace delimited text file, one sentence per line
+
+    Args:
+        sentences (iterable): Either 2D token id arrays (chunks of windows, as yielded by
+                              WindowCorpus.iter_chunks) or lists of words
+        path (str): Output file
+        token_names (np.ndarray, optional): token id -> word, ids are written as numbers if not given
+
+    Returns:
+        num_words (int): Total num of tokens written
+    """
+
+    num_words = 0
+
+    with open(path, 'w') as f:
+        for chunk in sentences:
+
+            if isinstance(chunk, np.ndarray) and chunk.ndim == 2:
+                rows = (token_names[chunk] if token_names is not None else chunk.astype(str)).tolist()
+            else:
+                rows = [[str(word) for word in chunk]]
+
+            if rows:
+                f.write('\n'.join(map(' '.join, rows)))
+                f.write('\n')
+            num_words += sum(map(len, rows))
+
+    return num_words
@@ -0,0 +1,158 @@
+import json
+import os
+
+import numpy as np
+
+from search import token_vectors
+
+
+SHIFTED_SUM_MAX_WINDOW = 16         # Longer windows are summed from a running sum
+
+
+class EmbeddingStore:
+    """
+    Read-only token vectors exported from a trained Word2Vec model, for serving without gensim
+
+    The store is a directory with a float32 (vocab size, vector size) matrix in token id order & the
+    token id -> word map. The matrix is memory mapped on open, so a store opens in milliseconds and
+    every process that opens it shares one copy of the vectors through the page cache.
+
+        EmbeddingStore.export(model, './word2vec_ohlc.vectors', tokenizer.token_names)
+
+        store = EmbeddingStore('./word2vec_ohlc.vectors')
+        token_ids = tokenizer.encode(stock.data)
+        embeddings = store.embed(token_ids, window=10)      # every window of 10 candles, at once
+        latest = store.embed(token_ids[-10:], window=10)[0]
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Directory written by EmbeddingStore.export
+        """
+
+        self.path = path
+
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+
+        self.vectors = np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r')
+        self.known = np.load(os.path.join(path, 'known.npy'), mmap_mode='r')         # False for tokens the model never saw
+        self.token_names = np.load(os.path.join(path, 'token_names.npy'))
+
+        self.vocab_size, self.vector_size = self.vectors.shape
+        self._word_to_id = None
+
+
+    @classmethod
+    def export(cls, model, path, token_names):
+        """
+        Writes the vectors of <model> in token id order (zero rows for tokens it never saw)
+
+        Args:
+            model (gensim.models.Word2Vec): trained on words of token_names
+            path (str): Output directory
+            token_names (np.ndarray): token id -> word, Eg. CandleTokenizer.token_names
+
+        Returns:
+            store (EmbeddingStore)
+        """
+
+        os.makedirs(path, exist_ok=True)
+        token_names = np.asarray(token_names)
+
+        np.save(os.path.join(path, 'vectors.npy'), token_vectors(model, token_names))
+        np.save(os.path.join(path, 'known.npy'), np.array([word in model.wv.key_to_index for word in token_names]))
+        np.save(os.path.join(path, 'token_names.npy'), token_names)
+
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'vocab_size': len(token_names), 'vector_size': int(model.wv.vector_size)}, f)
+
+        return cls(path)
+
+
+    def __len__(self):
+
+        return self.vocab_size
+
+
+    def token_id(self, word):
+        """
+        Token id of a word, KeyError if the word is not in the vocabulary
+        """
+
+        if self._word_to_id is None:
+            self._word_to_id = {word: token_id for token_id, word in enumerate(self.token_names.tolist())}
+
+        return self._word_to_id[word]
+
+
+    def __getitem__(self, word):
+        """
+        Vector of a word (a view into the store)
+        """
+
+        return self.vectors[self.token_id(word)]
+
+
+    def embed(self, token_ids, window=None, stride=1, normalize=True, chunk_size=65536):
+        """
+        Window embeddings for whole token arrays, the mean of the window's token vectors
+
+        A 1D array gets an embedding per window of <window> consecutive tokens (every <stride>-th), summed
+        from shifted views of the token vectors (a running sum for long windows) instead of gathering a
+        (num windows, window, vector size) array. A 2D (num windows, window) array, Eg. a chunk of
+        WindowCorpus.iter_chunks, gets one embedding per row.
+
+        Args:
+            token_ids (np.ndarray): 1D token ids, or 2D windows of token ids
+            window (int, optional): Tokens per window, for 1D token_ids. Defaults to None (2D input).
+            stride (int, optional): Tokens between window starts. Defaults to 1.
+            normalize (bool, optional): Scale every embedding to unit length, as search.pool_windows. Defaults to True.
+            chunk_size (int, optional): Windows computed at a time. Defaults to 65536.
+
+        Returns:
+            embeddings (np.ndarray): (num windows, vector size) float32
+        """
+
+        token_ids = np.asarray(token_ids)
+
+        if token_ids.ndim == 2:
+            embeddings = np.empty((len(token_ids), self.vector_size), dtype=np.float32)
+            for begin in range(0, len(token_ids), chunk_size):
+                embeddings[begin : begin + chunk_size] = self.vectors[token_ids[begin : begin + chunk_size]].mean(axis=1)
+
+        else:
+            if window is None:
+                raise ValueError('window is needed to embed a 1D token array')
+
+            num_windows = max(len(token_ids) - window + 1, 0)
+            starts = np.arange(0, num_windows, stride)
+            embeddings = np.empty((len(starts), self.vector_size), dtype=np.float32)
+
+            # Chunk by chunk, with window - 1 tokens of overlap
+            for begin in range(0, len(starts), chunk_size):
+                chunk_starts = starts[begin : begin + chunk_size]
+                first, last = chunk_starts[0], chunk_starts[-1] + window
+                chunk_vectors = self.vectors[token_ids[first:last]]
+                offsets = chunk_starts - first
+
+                if window <= SHIFTED_SUM_MAX_WINDOW:
+                    # Short windows : <window> vectorized adds of shifted views
+                    sums = chunk_vectors[: len(chunk_vectors) - window + 1].copy()
+                    for shift in range(1, window):
+                        sums += chunk_vectors[shift : shift + len(sums)]
+                    sums = sums[offsets]
+                else:
+                    # Long windows : differences of a float64 running sum, the cost does not grow with the window
+                    running = np.zeros((len(chunk_vectors) + 1, self.vector_size), dtype=np.float64)
+                    np.cumsum(chunk_vectors, axis=0, dtype=np.float64, out=running[1:])
+                    sums = running[offsets + window] - running[offsets]
+
+                embeddings[begin : begin + len(chunk_starts)] = sums / window
+
+        if normalize:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            np.divide(embeddings, norms, out=embeddings, where=norms > 0)
+
+        return embeddings
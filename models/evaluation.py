@@ -0,0 +1,365 @@
+import hashlib
+import itertools
+import json
+import os
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+from corpus import WindowCorpus
+from search import pool_windows, token_vectors
+from tokenizer import CandleTokenizer
+
+
+# Word2Vec & corpus settings of a fold, the tokenizer (vocabulary) settings are the VOCAB_KEYS
+DEFAULT_CONFIG = {'vector_size'     : 50,
+                  'window'          : 5,          # Word2Vec context window
+                  'sequence_length' : 10,         # Candles per corpus window / embedded window
+                  'min_count'       : 1,
+                  'sg'              : 1,
+                  'epochs'          : 5,
+                  'horizon'         : 1,          # Predict the return over the next <horizon> candles
+                  'ridge'           : 1.0,        # L2 penalty of the return regression
+                  'seed'            : 0,
+                  }
+
+VOCAB_KEYS = ('body_bins', 'wick_bins', 'reference')
+
+
+def walk_forward_folds(num_days, train_days, test_days, step_days=None, expanding=False):
+    """
+    Day ranges of rolling train / test folds, each test range follows its train range
+
+    Args:
+        num_days (int): Num of trading days
+        train_days (int): Trading days per train range (the first one when expanding)
+        test_days (int): Trading days per test range
+        step_days (int, optional): Days between fold starts. Defaults to None (test_days, back to back tests).
+        expanding (bool, optional): Train ranges all start at day 0 instead of rolling. Defaults to False.
+
+    Returns:
+        folds (list): (train_first_day, test_first_day, test_end_day) day positions, the end is exclusive
+    """
+
+    step_days = step_days or test_days
+
+    folds = []
+    test_first = train_days
+    while test_first + test_days <= num_days:
+        folds.append((0 if expanding else test_first - train_days, test_first, test_first + test_days))
+        test_first += step_days
+
+    return folds
+
+
+def _window_targets(corpus, closes, day_ids, horizon):
+    """
+    Log return from the last candle of every window to <horizon> candles later, NaN across a day end
+    (day_ids None : day candles, the return may span days)
+    """
+
+    last = corpus.starts + corpus.window - 1
+    ahead = np.minimum(last + horizon, len(closes) - 1)
+
+    valid = last + horizon < len(closes)
+    if day_ids is not None:
+        valid &= day_ids[ahead] == day_ids[last]
+
+    return np.where(valid, np.log(closes[ahead]/closes[last]), np.nan)
+
+
+def _ridge_fit(x, y, penalty):
+    """
+    Ridge regression with an intercept, returns (coefficients, intercept)
+    """
+
+    x_mean, y_mean = x.mean(axis=0), y.mean()
+    xc = x - x_mean
+
+    coef = np.linalg.solve(xc.T @ xc + penalty*np.eye(x.shape[1]), xc.T @ (y - y_mean))
+
+    return coef, y_mean - x_mean @ coef
+
+
+def _evaluate_fold(task):
+    """
+    Worker : trains an embedding on the train candles of a fold & scores the test candles
+
+    The return of every window is regressed (ridge) on the window's embedding over the train range,
+    the test range is then scored on directional accuracy & the information coefficient (correlation
+    of predicted & realised returns).
+    """
+
+    # Imported here so the parent can plan & read cached folds without gensim
+    from training import train_word2vec
+
+    config = task['config']
+    token_ids, closes, day_ids, split = task['token_ids'], task['closes'], task['day_ids'], task['split']
+
+    corpora = {}
+    for part, rows in (('train', slice(0, split)), ('test', slice(split, len(token_ids)))):
+        corpora[part] = WindowCorpus(token_ids[rows], window=config['sequence_length'],
+                                     day_ids=None if day_ids is None else day_ids[rows], token_names=task['token_names'])
+
+    model, epoch_stats = train_word2vec(corpora['train'], workers=task['workers'], verbose=False,
+                                        vector_size=config['vector_size'], window=config['window'],
+                                        min_count=config['min_count'], sg=config['sg'],
+                                        epochs=config['epochs'], seed=config['seed'])
+
+    vectors = token_vectors(model, task['token_names'])
+
+    scores = {}
+    for part, offset in (('train', 0), ('test', split)):
+        corpus = corpora[part]
+        embeddings = np.concatenate([pool_windows(vectors, chunk) for chunk in corpus.iter_chunks()]) \
+            if len(corpus) else np.empty((0, config['vector_size']), dtype=np.float32)
+        targets = _window_targets(corpus, closes[offset:], None if day_ids is None else day_ids[offset:], config['horizon'])
+        keep = ~np.isnan(targets)
+        scores[part] = (embeddings[keep].astype(np.float64), targets[keep])
+
+    (x_train, y_train), (x_test, y_test) = scores['train'], scores['test']
+
+    result = {'key'           : task['key'],
+              'train_windows' : len(y_train),
+              'test_windows'  : len(y_test),
+              'train_secs'    : sum(stat['wall_secs'] for stat in epoch_stats),
+              'accuracy'      : None,
+              'baseline'      : None,
+              'ic'            : None,
+              }
+
+    if len(y_train) > config['vector_size'] and len(y_test):
+        coef, intercept = _ridge_fit(x_train, y_train, config['ridge'])
+        predicted = x_test @ coef + intercept
+
+        moved = y_test != 0
+        result['accuracy'] = float(np.mean(np.sign(predicted[moved]) == np.sign(y_test[moved]))) if moved.any() else None
+
+        # Always predicting the more frequent direction of the train range
+        majority = 1.0 if np.mean(y_train > 0) >= np.mean(y_train < 0) else -1.0
+        result['baseline'] = float(np.mean(np.sign(y_test[moved]) == majority)) if moved.any() else None
+
+        if np.std(predicted) > 0 and np.std(y_test) > 0:
+            result['ic'] = float(np.corrcoef(predicted, y_test)[0, 1])
+
+    return result
+
+
+class WalkForward:
+    """
+    Walk-forward evaluation of candle embeddings : does an embedding trained up to a day help predict
+    the returns of the days after it
+
+    The history of a Stock is split into rolling train / test folds of trading days. For every fold &
+    config a Word2Vec model is trained on the train candles only, its window embeddings are fitted to
+    the next <horizon> candle return & scored on the test candles. Folds run across a process pool.
+
+    Every fold result is cached as JSON under the hash of its config & the data of its range, so a
+    rerun, a grid with one more value or a history with new days only computes the folds that changed.
+
+        walk_forward = WalkForward(stock, train_days=250, test_days=20)
+        results = walk_forward.run_grid({'vector_size': [16, 50], 'window': [3, 5], 'body_bins': [(0.02, 0.05, 0.1)]})
+        results.groupby(['vector_size', 'window'])[['accuracy', 'ic']].mean()
+    """
+
+    def __init__(self, stock, train_days=250, test_days=20, step_days=None, expanding=False,
+                 cache_dir='./walkforward.cache', processes=None, workers_per_fold=1):
+        """
+        Args:
+            stock (Stock): Candles to evaluate on
+            train_days (int, optional): Trading days per train range. Defaults to 250.
+            test_days (int, optional): Trading days per test range. Defaults to 20.
+            step_days (int, optional): Days between folds. Defaults to None (test_days).
+            expanding (bool, optional): Train on all the days before each test range. Defaults to False.
+            cache_dir (str, optional): Fold results cache, None disables it. Defaults to './walkforward.cache'.
+            processes (int, optional): Size of the process pool, 1 runs in this process. Defaults to None (num of cores).
+            workers_per_fold (int, optional): Word2Vec threads of each fold. Defaults to 1.
+        """
+
+        self.stock = stock
+        self.cache_dir = cache_dir
+        self.processes = processes
+        self.workers_per_fold = workers_per_fold
+
+        self.folds = walk_forward_folds(len(stock.day_keys), train_days, test_days, step_days, expanding)
+        self._tokens = {}           # vocabulary key -> (token ids, token names)
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+
+    def run(self, config=None, verbose=True):
+        """
+        Evaluates one config on every fold
+
+        Args:
+            config (Dict, optional): Overrides of DEFAULT_CONFIG & CandleTokenizer arguments (VOCAB_KEYS)
+            verbose (bool, optional): Print the num of cached folds & folds to run. Defaults to True.
+
+        Returns:
+            results (pandas Dataframe): One row per fold
+        """
+
+        return self.run_grid({key: [value] for key, value in (config or {}).items()}, verbose=verbose)
+
+
+    def run_grid(self, grid, verbose=True):
+        """
+        Evaluates every combination of the values in <grid> on every fold
+
+        Args:
+            grid (Dict): config key -> list of values, Eg. {'vector_size': [16, 32, 50], 'window': [3, 5]}
+            verbose (bool, optional): Print the num of cached folds & folds to run. Defaults to True.
+
+        Returns:
+            results (pandas Dataframe): One row per config & fold, with the config values, the fold's
+                                        dates & its scores (accuracy, baseline, ic, ...)
+        """
+
+        unknown = [key for key in grid if key not in DEFAULT_CONFIG and key not in VOCAB_KEYS]
+        if unknown:
+            raise ValueError(f'Unknown config keys {unknown}, available keys are {list(DEFAULT_CONFIG) + list(VOCAB_KEYS)}')
+
+        keys = list(grid)
+        configs = [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+        rows, tasks = [], []
+        for overrides in configs:
+            for fold_num, fold in enumerate(self.folds):
+                row, task = self._plan(overrides, fold_num, fold)
+                rows.append(row)
+                if task is not None:
+                    tasks.append(task)
+
+        if verbose:
+            print(f'{len(rows)} FOLDS : {len(rows) - len(tasks)} CACHED, {len(tasks)} TO RUN')
+
+        computed = {result['key']: result for result in self._map(tasks)}
+        for result in computed.values():
+            self._store(result)
+
+        for row in rows:
+            row.update(computed.get(row['key']) or self._load(row['key']))
+
+        return pd.DataFrame(rows)
+
+
+    def _plan(self, overrides, fold_num, fold):
+        """
+        Result row skeleton of a fold & its task, the task is None if the result is cached
+        """
+
+        config = dict(DEFAULT_CONFIG)
+        config.update({key: value for key, value in overrides.items() if key in DEFAULT_CONFIG})
+        vocab = {key: overrides[key] for key in VOCAB_KEYS if key in overrides}
+
+        token_ids, token_names = self._tokenize(vocab)
+
+        train_first, test_first, test_end = fold
+        stock = self.stock
+        first_row, split_row, end_row = stock.day_starts[train_first], stock.day_starts[test_first], stock.day_ends[test_end - 1]
+
+        rows = slice(first_row, end_row)
+        closes = stock.prices(('close',))['close'][rows]
+        token_ids = token_ids[rows]
+
+        # Hash of everything the result depends on
+        digest = hashlib.sha256()
+        digest.update(json.dumps({'config': config, 'vocab': _jsonable(vocab),
+                                  'range': [int(stock._index_ns[first_row]), int(stock._index_ns[split_row]),
+                                            int(stock._index_ns[end_row - 1])]}, sort_keys=True).encode())
+        digest.update(np.ascontiguousarray(token_ids).tobytes())
+        digest.update(np.ascontiguousarray(closes).tobytes())
+        key = digest.hexdigest()[:32]
+
+        row = dict(overrides)
+        row.update({'fold'        : fold_num,
+                    'train_start' : stock.data.index[first_row],
+                    'test_start'  : stock.data.index[split_row],
+                    'test_end'    : stock.data.index[end_row - 1],
+                    'key'         : key,
+                    })
+
+        if self._load(key) is not None:
+            return row, None
+
+        # Windows & returns of intraday candles stay within a session, day candles span days
+        day_ids = None
+        if stock.cdst_duration_days is None:
+            day_ids = np.repeat(np.arange(train_first, test_end), stock.day_counts[train_first:test_end])
+
+        task = {'key'         : key,
+                'config'      : config,
+                'token_ids'   : token_ids,
+                'token_names' : token_names,
+                'closes'      : closes,
+                'day_ids'     : day_ids,
+                'split'       : split_row - first_row,
+                'workers'     : self.workers_per_fold,
+                }
+
+        return row, task
+
+
+    def _tokenize(self, vocab):
+        """
+        Token ids of the full history for a vocabulary, once per vocabulary (an ema50 reference needs the full history)
+        """
+
+        vocab_key = json.dumps(_jsonable(vocab), sort_keys=True)
+        if vocab_key not in self._tokens:
+            tokenizer = CandleTokenizer(**vocab)
+            self._tokens[vocab_key] = (tokenizer.encode(self.stock.prices()), tokenizer.token_names)
+
+        return self._tokens[vocab_key]
+
+
+    def _map(self, tasks):
+
+        if not tasks:
+            return []
+
+        if self.processes == 1 or len(tasks) == 1:
+            return [_evaluate_fold(task) for task in tasks]
+
+        with Pool(processes=self.processes) as pool:
+            return list(pool.imap_unordered(_evaluate_fold, tasks))
+
+
+    def _cache_path(self, key):
+
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+
+    def _load(self, key):
+
+        if self.cache_dir is None or not os.path.exists(self._cache_path(key)):
+            return None
+
+        with open(self._cache_path(key)) as f:
+            return json.load(f)
+
+
+    def _store(self, result):
+
+        if self.cache_dir is None:
+            return
+
+        tmp_path = self._cache_path(result['key']) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(result, f)
+        os.replace(tmp_path, self._cache_path(result['key']))
+
+
+def _jsonable(value):
+    """
+    Tuples & arrays as lists, so that equal configs hash equal
+    """
+
+    if isinstance(value, dict):
+        return {key: _jsonable(item) for key, item in value.items()}
+    if isinstance(value, (tuple, list, np.ndarray)):
+        return [_jsonable(item) for item in value]
+
+    return value
@@ -0,0 +1,146 @@
+import numpy as np
+import pandas as pd
+
+
+EMA_SPAN = 50
+
+# Every feature add_additional_features can produce, in the order the columns are added
+FEATURES = ['ema50', 'center', 'head', 'tail', 'body', 'range',
+            'head_per_wrt_ema50', 'tail_per_wrt_ema50', 'body_per_wrt_ema50',
+            'head_per_wrt_center', 'tail_per_wrt_center', 'body_per_wrt_center',
+            ]
+
+# Features that have to be computed first for a feature to be computed
+DEPENDENCIES = {'head_per_wrt_ema50'  : ['head', 'ema50'],
+                'tail_per_wrt_ema50'  : ['tail', 'ema50'],
+                'body_per_wrt_ema50'  : ['body', 'ema50'],
+                'head_per_wrt_center' : ['head', 'center'],
+                'tail_per_wrt_center' : ['tail', 'center'],
+                'body_per_wrt_center' : ['body', 'center'],
+                }
+
+
+class FeatureEngine:
+    """
+    Computes the candle features of Stock.add_additional_features from OHLC arrays
+
+    The only state the features carry from one candle to the next is the ema50, it is kept
+    after every call so that new candles can be added with update() in O(new rows) :
+
+        engine = FeatureEngine(['body_per_wrt_ema50'], dtype=np.float32)
+        history = engine.compute(stock.data)        # full history, resets the state
+        today = engine.update(new_candles_df)       # continues from the last candle of history
+
+    Only the requested features are returned, their dependencies are computed but not kept.
+    Intermediate math is float64, the returned arrays are cast to <dtype>.
+    """
+
+    def __init__(self, features=None, dtype=np.float64):
+        """
+        Args:
+            features (list, optional): Subset of FEATURES. Defaults to None (all features).
+            dtype (np.dtype, optional): dtype of the returned arrays, Eg. np.float32. Defaults to np.float64.
+        """
+
+        features = list(FEATURES) if features is None else list(features)
+
+        unknown = [name for name in features if name not in FEATURES]
+        if unknown:
+            raise ValueError(f'Unknown features {unknown}, available features are {FEATURES}')
+
+        self.features = features
+        self.dtype = np.dtype(dtype)
+
+        self.ema_last = None        # ema50 of the last candle seen
+        self.rows_seen = 0          # Num of candles the state has been built from
+
+
+    def reset(self):
+
+        self.ema_last = None
+        self.rows_seen = 0
+
+
+    def compute(self, ohlc):
+        """
+        Features over a full history, the state is reset first
+
+        Args:
+            ohlc (pandas Dataframe or Dict): has 'open', 'high', 'low', 'close' columns
+
+        Returns:
+            features (Dict): feature name -> np.ndarray of <dtype>
+        """
+
+        self.reset()
+
+        return self.update(ohlc)
+
+
+    def update(self, ohlc):
+        """
+        Features of candles that follow the ones already seen, ema50 continues from the carried state
+
+        Args:
+            ohlc (pandas Dataframe or Dict): has 'open', 'high', 'low', 'close' columns
+
+        Returns:
+            features (Dict): feature name -> np.ndarray of <dtype>, one value per new candle
+        """
+
+        o = np.asarray(ohlc['open'], dtype=np.float64)
+        h = np.asarray(ohlc['high'], dtype=np.float64)
+        l = np.asarray(ohlc['low'], dtype=np.float64)
+        c = np.asarray(ohlc['close'], dtype=np.float64)
+
+        needed = set(self.features)
+        for name in self.features:
+            needed.update(DEPENDENCIES.get(name, []))
+
+        values = {}
+
+        if 'ema50' in needed:
+            values['ema50'] = self._ema(c)
+
+        if 'center' in needed:
+            values['center'] = (o + c)/2
+
+        if 'head' in needed:
+            values['head'] = h - np.maximum(o, c)
+        if 'tail' in needed:
+            values['tail'] = np.minimum(o, c) - l
+        if 'body' in needed:
+            values['body'] = np.abs(o - c)
+        if 'range' in needed:
+            values['range'] = np.abs(h - l)
+
+        for name in self.features:
+            if name in DEPENDENCIES:
+                part, ref = DEPENDENCIES[name]
+                values[name] = (values[part]/values[ref])*100
+
+        self.rows_seen += len(c)
+
+        return {name : values[name].astype(self.dtype, copy=False) for name in self.features}
+
+
+    def _ema(self, close):
+        """
+        ema50 (same as pandas ewm(span=50, adjust=False)) continued from self.ema_last
+        """
+
+        if len(close) == 0:
+            return close.copy()
+
+        # Seeding the series with the last ema makes the recursion carry on from it
+        if self.ema_last is not None:
+            close = np.concatenate([[self.ema_last], close])
+
+        ema = pd.Series(close).ewm(span=EMA_SPAN, adjust=False).mean().to_numpy()
+
+        if self.ema_last is not None:
+            ema = ema[1:]
+
+        self.ema_last = float(ema[-1])
+
+        return ema
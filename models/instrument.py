@@ -0,0 +1,241 @@
+import cProfile
+import collections
+import functools
+import json
+import logging
+import os
+import re
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:         # Not available on Windows, peak RSS is then not reported
+    resource = None
+
+
+logger = logging.getLogger('candle2vec.spans')
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process so far in MB, None where the platform does not report it
+    """
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # kilobytes on Linux, bytes on macOS
+    return peak / (2**20 if os.uname().sysname == 'Darwin' else 2**10)
+
+
+class Recorder:
+    """
+    Collects the finished spans of the process, the most recent max_spans of them
+
+    Normal mode costs two clock reads & a getrusage call per span, cheap enough to leave on.
+    Deep mode (profile_dir / trace_memory) runs cProfile & tracemalloc around the outermost spans
+    only, a profiler cannot be nested & tracing slows Python code down several times.
+    """
+
+    def __init__(self, max_spans=10_000):
+
+        self.enabled = True
+        self.profile_dir = None             # cProfile stats of every outermost span are dumped here
+        self.trace_memory = False           # tracemalloc peak of every outermost span
+        self.spans = collections.deque(maxlen=max_spans)
+        self._local = threading.local()     # Stack of the open spans of each thread
+
+
+    def stack(self):
+
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+
+        return self._local.stack
+
+
+    def add(self, record):
+
+        self.spans.append(record)
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(record), extra={'span': record})
+
+
+recorder = Recorder()
+
+
+def configure(enabled=None, profile_dir=None, trace_memory=None, max_spans=None):
+    """
+    Changes what spans record, arguments left as None are not changed
+
+    Args:
+        enabled (bool, optional): Record spans at all.
+        profile_dir (str or False, optional): Dump cProfile stats of the outermost spans to
+                                              <profile_dir>/<name>.<num>.prof, False turns it off.
+        trace_memory (bool, optional): Record the tracemalloc peak of the outermost spans.
+        max_spans (int, optional): Num of most recent spans kept.
+    """
+
+    if enabled is not None:
+        recorder.enabled = enabled
+    if profile_dir is not None:
+        recorder.profile_dir = profile_dir or None
+        if recorder.profile_dir:
+            os.makedirs(recorder.profile_dir, exist_ok=True)
+    if trace_memory is not None:
+        recorder.trace_memory = trace_memory
+    if max_spans is not None:
+        recorder.spans = collections.deque(recorder.spans, maxlen=max_spans)
+
+
+class span:
+    """
+    Times a stage of the pipeline, as a context manager or a decorator
+
+        with span('stock.read_csv') as s:
+            df = pd.read_csv(csv_path)
+            s.rows = len(df)
+
+        @span('corpus.tokenize')
+        def encode(...):
+
+    Every finished span is kept in recorder.spans as a dict :
+        name, parent, depth, started (unix time), wall_secs, rows, rows_per_sec, peak_rss_mb
+        (+ traced_peak_mb & profile in deep mode)
+    and logged as JSON on the 'candle2vec.spans' logger at INFO level.
+    """
+
+    def __init__(self, name, rows=None):
+        """
+        Args:
+            name (str): Stage name, Eg. 'stock.read_csv'
+            rows (int, optional): Num of rows the stage processes, can also be set on the span
+                                  inside the block. Defaults to None.
+        """
+
+        self.name = name
+        self.rows = rows
+        self.record = None
+
+        self._start = None
+        self._profiler = None
+        self._tracing = False
+
+
+    def __enter__(self):
+
+        if not recorder.enabled:
+            return self
+
+        stack = recorder.stack()
+        self.record = {'name'    : self.name,
+                       'parent'  : stack[-1].name if stack else None,
+                       'depth'   : len(stack),
+                       'started' : time.time(),
+                       }
+        stack.append(self)
+
+        # Deep mode, outermost spans only
+        if not self.record['depth']:
+            if recorder.trace_memory:
+                if tracemalloc.is_tracing():
+                    tracemalloc.reset_peak()
+                else:
+                    tracemalloc.start()
+                    self._tracing = True        # Stopped again on exit
+            if recorder.profile_dir:
+                self._profiler = cProfile.Profile()
+                self._profiler.enable()
+
+        self._start = time.perf_counter()
+
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+
+        if self.record is None:
+            return False
+
+        wall_secs = time.perf_counter() - self._start
+
+        record = self.record
+        record['wall_secs'] = wall_secs
+        record['rows'] = None if self.rows is None else int(self.rows)
+        record['rows_per_sec'] = self.rows/wall_secs if self.rows is not None and wall_secs > 0 else None
+        record['peak_rss_mb'] = peak_rss_mb()
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+
+        if self._profiler is not None:
+            self._profiler.disable()
+            file_name = re.sub(r'[^\w.-]', '_', self.name)
+            record['profile'] = os.path.join(recorder.profile_dir, f'{file_name}.{len(recorder.spans)}.prof')
+            self._profiler.dump_stats(record['profile'])
+            self._profiler = None
+
+        if not record['depth'] and recorder.trace_memory and tracemalloc.is_tracing():
+            record['traced_peak_mb'] = tracemalloc.get_traced_memory()[1] / 2**20
+            if self._tracing:
+                tracemalloc.stop()
+                self._tracing = False
+
+        stack = recorder.stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+
+        recorder.add(record)
+        self.record = None
+
+        return False
+
+
+    def __call__(self, fn):
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(self.name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+
+def get_spans(name=None):
+    """
+    Recorded spans, oldest first, optionally only those named <name>
+    """
+
+    return [record for record in recorder.spans if name is None or record['name'] == name]
+
+
+def reset():
+    """
+    Forgets every recorded span
+    """
+
+    recorder.spans.clear()
+
+
+def export_json(path):
+    """
+    Writes the recorded spans to <path>, as a JSON list
+    """
+
+    with open(path, 'w') as f:
+        json.dump(get_spans(), f, indent=2)
+
+
+def print_summary():
+    """
+    Prints one line per recorded span in the order they started, nested spans indented under their parent
+    """
+
+    for record in sorted(get_spans(), key=lambda record: (record['started'], record['depth'])):
+        rows = '' if record['rows'] is None else f"{record['rows']:>12,} rows {record['rows_per_sec'] or 0:>14,.0f} rows/sec"
+        rss = '' if record['peak_rss_mb'] is None else f"  peak RSS {record['peak_rss_mb']:,.0f} MB"
+        print(f"{'  ' * record['depth']}{record['name']:<{32 - 2*record['depth']}} {record['wall_secs']:>9.3f} secs {rows}{rss}")
@@ -0,0 +1,375 @@
+import json
+import os
+import socket
+import time
+
+import numpy as np
+
+from resample import NS_PER_MIN, bucket_ids
+
+
+BAR_FIELDS = ['date', 'open', 'high', 'low', 'close', 'volume']
+TICK_FIELDS = ['date', 'price', 'volume']
+
+
+def parse_message(line):
+    """
+    Parses one line of a feed into a bar or a tick
+
+    Lines are either JSON objects or comma separated values :
+        bar  : {"date": ..., "open": ..., "high": ..., "low": ..., "close": ..., "volume": ...}
+               or 'date,open,high,low,close,volume' (the format of the csv files in data/)
+        tick : {"date": ..., "price": ..., "volume": ...} or 'date,price,volume' (volume is optional)
+
+    Args:
+        line (str)
+
+    Returns:
+        (kind, message) : kind is 'bar' or 'tick', message a Dict of the fields
+        None for blank & header lines
+    """
+
+    line = line.strip()
+    if not line:
+        return None
+
+    if line.startswith('{'):
+        message = json.loads(line)
+        return ('bar' if 'open' in message else 'tick'), message
+
+    values = line.split(',')
+    try:
+        numbers = [float(value) for value in values[1:]]
+    except ValueError:
+        return None         # Header line
+
+    if len(values) == len(BAR_FIELDS):
+        kind, message = 'bar', dict(zip(BAR_FIELDS, [values[0]] + numbers))
+    elif len(values) in (2, 3):
+        kind, message = 'tick', dict(zip(TICK_FIELDS, [values[0]] + numbers))
+    else:
+        raise ValueError(f'Cannot parse feed line {line!r}')
+
+    if 'volume' in message:
+        message['volume'] = int(message['volume'])
+
+    return kind, message
+
+
+class TickAggregator:
+    """
+    Aggregates ticks into OHLCV bars of <timeframe> minutes, anchored at 9:15 like Stock.resample
+
+    A bar is finished when a tick of a later bar arrives, or by close_due once the feed clock passes its end,
+    so a quiet market does not hold the last bar back. Times are int64 nanoseconds of exchange local time.
+    Ticks that arrive after their bar was finished are dropped & counted in late_ticks.
+    """
+
+    def __init__(self, timeframe=1):
+        """
+        Args:
+            timeframe (int, optional): Bar size in minutes. Defaults to 1.
+        """
+
+        self.timeframe = timeframe
+        self.bar = None             # The bar in progress, a Dict of BAR_FIELDS & 'bucket'
+        self.last_bucket = None     # Bucket of the last finished bar
+        self.late_ticks = 0
+
+
+    def add(self, local_ns, prices, volumes=None):
+        """
+        Adds ticks (in time order), vectorized over the batch
+
+        Args:
+            local_ns (np.ndarray): int64 exchange local nanoseconds of each tick
+            prices (np.ndarray): Traded price of each tick
+            volumes (np.ndarray, optional): Traded quantity of each tick. Defaults to None (0).
+
+        Returns:
+            bars (list): Bars finished by these ticks, oldest first
+        """
+
+        local_ns = np.atleast_1d(np.asarray(local_ns, dtype=np.int64))
+        prices = np.atleast_1d(np.asarray(prices, dtype=np.float64))
+        volumes = np.zeros(len(prices), dtype=np.int64) if volumes is None else np.atleast_1d(np.asarray(volumes))
+        if not len(prices):
+            return []
+
+        buckets, bar_start_ns = bucket_ids(local_ns, self.timeframe)
+
+        if self.last_bucket is not None and buckets[0] <= self.last_bucket:
+            late = buckets <= self.last_bucket
+            self.late_ticks += int(late.sum())
+            buckets, prices, volumes = buckets[~late], prices[~late], volumes[~late]
+            if not len(buckets):
+                return []
+
+        starts = np.flatnonzero(np.diff(buckets, prepend=buckets[:1] - 1))
+        ends = np.append(starts[1:], len(buckets))
+
+        finished = []
+        for start, end in zip(starts, ends):
+            bucket = int(buckets[start])
+            run = slice(start, end)
+
+            if self.bar is not None and bucket == self.bar['bucket']:
+                bar = self.bar
+                bar['high'] = max(bar['high'], float(prices[run].max()))
+                bar['low'] = min(bar['low'], float(prices[run].min()))
+                bar['close'] = float(prices[end - 1])
+                bar['volume'] += int(volumes[run].sum())
+                continue
+
+            if self.bar is not None:
+                if bucket < self.bar['bucket']:
+                    raise ValueError('Ticks have to be in time order')
+                finished.append(self._finish())
+
+            self.bar = {'bucket' : bucket,
+                        'date'   : int(bar_start_ns(bucket)),
+                        'open'   : float(prices[start]),
+                        'high'   : float(prices[run].max()),
+                        'low'    : float(prices[run].min()),
+                        'close'  : float(prices[end - 1]),
+                        'volume' : int(volumes[run].sum()),
+                        }
+
+        return finished
+
+
+    def close_due(self, now_local_ns):
+        """
+        Finishes the bar in progress if the feed clock is past its end
+
+        Args:
+            now_local_ns (int): Current time of the feed, exchange local nanoseconds (not the wall clock,
+                                a lagging or replayed feed would get its bars closed early)
+
+        Returns:
+            bars (list): [the finished bar] or []
+        """
+
+        if self.bar is not None and now_local_ns >= self.bar['date'] + self.timeframe * NS_PER_MIN:
+            return [self._finish()]
+
+        return []
+
+
+    def flush(self):
+        """
+        Finishes the bar in progress, Eg. when the feed ends
+        """
+
+        return [self._finish()] if self.bar is not None else []
+
+
+    def _finish(self):
+
+        bar, self.bar = self.bar, None
+        self.last_bucket = bar.pop('bucket')
+
+        return bar
+
+
+def tail_file(path, poll_secs=0.05, from_start=False, stop=None):
+    """
+    Follows a file that is being appended to (like tail -f), yields its complete lines
+
+    None is yielded whenever there was nothing new to read, so the consumer gets a chance to
+    close bars on time (see LiveIngester.run).
+
+    Args:
+        path (str): Path of the file
+        poll_secs (float, optional): Sleep between reads when there is nothing new. Defaults to 0.05.
+        from_start (bool, optional): Read the lines already in the file first. Defaults to False.
+        stop (threading.Event, optional): Stops following when set. Defaults to None (follows forever).
+    """
+
+    with open(path) as f:
+        if not from_start:
+            f.seek(0, os.SEEK_END)
+
+        partial = ''
+        while stop is None or not stop.is_set():
+            chunk = f.readline()
+            if not chunk:
+                yield None
+                time.sleep(poll_secs)
+                continue
+
+            partial += chunk
+            if partial.endswith('\n'):
+                yield partial
+                partial = ''
+
+
+def unix_socket_lines(path, timeout_secs=0.05, stop=None):
+    """
+    Connects to a UNIX socket feed & yields its lines until the publisher closes the connection
+
+    None is yielded whenever nothing arrived for timeout_secs (see tail_file).
+
+    Args:
+        path (str): Path of the socket, Eg. the one serve_unix_socket listens on
+        timeout_secs (float, optional): Defaults to 0.05.
+        stop (threading.Event, optional): Stops reading when set. Defaults to None.
+    """
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.settimeout(timeout_secs)
+
+        partial = b''
+        while stop is None or not stop.is_set():
+            try:
+                data = sock.recv(65536)
+            except socket.timeout:
+                yield None
+                continue
+
+            if not data:
+                break
+
+            *lines, partial = (partial + data).split(b'\n')
+            for line in lines:
+                yield line.decode()
+
+        if partial:
+            yield partial.decode()
+
+
+def serve_unix_socket(path, lines, interval_secs=0.0):
+    """
+    Local stand-in for a market data publisher : serves <lines> to the first client of a UNIX socket
+    Blocks until every line is sent, run it in a thread or another process.
+
+        Thread(target=serve_unix_socket, args=('/tmp/feed.sock', open('RELIANCE_minute.csv'), 0.01)).start()
+
+    Args:
+        path (str): Path of the socket, replaced if it exists
+        lines (iterable of str): Lines to send, Eg. an open csv file
+        interval_secs (float, optional): Pause between lines. Defaults to 0.0.
+    """
+
+    if os.path.exists(path):
+        os.remove(path)
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(path)
+        server.listen(1)
+
+        connection, _ = server.accept()
+        with connection:
+            for line in lines:
+                connection.sendall(line.rstrip('\n').encode() + b'\n')
+                if interval_secs:
+                    time.sleep(interval_secs)
+
+    os.remove(path)
+
+
+class LiveIngester:
+    """
+    Feeds bars or ticks from a local source into a Stock as they arrive
+
+    Bars are appended as they come, ticks are aggregated into bars of the Stock's candle duration first.
+    Every append goes through Stock.append_candles, so the day table & the features are current when
+    on_candles is called with the row position of the new candles :
+
+        def on_candles(stock, first_row):
+            tokens = tokenizer.encode(stock.data.iloc[first_row - 9:])      # the last window of 10 candles
+            embedding = pool_windows(vectors, tokens[None, -10:])
+
+        ingester = LiveIngester(stock, on_candles=on_candles)
+        ingester.run(tail_file('./feed/RELIANCE_ticks.csv'))
+    """
+
+    def __init__(self, stock, on_candles=None, timeframe=None, close_bars_on_time=True):
+        """
+        Args:
+            stock (Stock): Stock to append to
+            on_candles (callable, optional): Called as on_candles(stock, first_row) after every append. Defaults to None.
+            timeframe (int, optional): Minutes per bar built from ticks. Defaults to None (the Stock's candle duration).
+            close_bars_on_time (bool, optional): Finish the bar in progress when the feed clock passes its end,
+                                                 instead of waiting for the next tick. Defaults to True.
+        """
+
+        self.stock = stock
+        self.on_candles = on_candles
+        self.close_bars_on_time = close_bars_on_time
+        self.aggregator = TickAggregator(timeframe or stock.cdst_duration_mins)
+
+        self.candles_appended = 0
+
+        # Feed clock : time of the latest message & when it was received, see _feed_now_ns
+        self._feed_ns = None
+        self._received = None
+
+
+    def feed(self, line):
+        """
+        Handles one line of the feed (see parse_message)
+        """
+
+        parsed = parse_message(line)
+        if parsed is None:
+            return
+
+        kind, message = parsed
+        local_ns = int(self.stock._to_index_ns(message['date'])[0])
+        self._feed_ns, self._received = local_ns, time.monotonic()
+
+        if kind == 'bar':
+            self._append(self.aggregator.close_due(local_ns))        # A tick bar that ended before this bar
+            self._append([message])
+        else:
+            self._append(self.aggregator.add(local_ns, message['price'], int(message.get('volume', 0))))
+
+
+    def poll(self):
+        """
+        Finishes the bar in progress if its time is up, call it when the source is idle
+        """
+
+        if self.close_bars_on_time and self._feed_ns is not None:
+            self._append(self.aggregator.close_due(self._feed_now_ns()))
+
+
+    def run(self, source):
+        """
+        Consumes a source until it ends, Eg. tail_file(...) or unix_socket_lines(...)
+        A None from the source means it is idle, the bar in progress is then closed if it is due.
+        """
+
+        for line in source:
+            if line is None:
+                self.poll()
+            else:
+                self.feed(line)
+
+        self._append(self.aggregator.flush())
+
+
+    def _append(self, bars):
+
+        if not bars:
+            return
+
+        candles = {field: [bar.get(field, 0) if field == 'volume' else bar[field] for bar in bars] for field in BAR_FIELDS}
+        if isinstance(candles['date'][0], (int, np.integer)):
+            candles['date'] = np.asarray(candles['date'], dtype=np.int64).view('M8[ns]')
+
+        first_row = self.stock.append_candles(candles)
+        self.candles_appended += len(bars)
+
+        if self.on_candles is not None:
+            self.on_candles(self.stock, first_row)
+
+
+    def _feed_now_ns(self):
+        """
+        Feed time now : the time of the latest message, advanced by the time spent idle since it was received
+        """
+
+        return self._feed_ns + int((time.monotonic() - self._received) * 1e9)
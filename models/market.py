@@ -0,0 +1,253 @@
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+from multiprocessing import Pool
+
+import numpy as np
+
+from cache import cache_dir_for, load_cache_arrays
+
+
+MODES = ('bar', 'group')
+
+
+def _tokenize_symbol(args):
+    """
+    Worker : tokenizes one symbol's full history into <token_path>, from its memory mapped cache
+    (source is the csv path) or from the arrays of an uncached symbol (source is the Dict of columns)
+    Only one symbol's candles are in memory at a time, & the ema50 reference sees the whole series.
+    """
+
+    source, token_path, tokenizer = args
+
+    arrays = load_cache_arrays(source)[0] if isinstance(source, str) else source
+    token_ids = tokenizer.encode({col: arrays[col] for col in ('open', 'high', 'low', 'close')})
+
+    tmp_path = token_path + '.tmp.npy'
+    np.save(tmp_path, token_ids)
+    os.replace(tmp_path, token_path)
+
+    return token_path
+
+
+# Per worker state of _write_chunk, set once by _init_chunk_worker
+_worker = {}
+
+
+def _init_chunk_worker(symbols, sources, token_names, tag_symbols):
+    """
+    Pool initializer : opens the dates & token arrays of every symbol once per worker, instead of once per chunk
+    """
+
+    _worker['dates'], _worker['token_ids'] = [], []
+    for source, token_path in sources:
+        _worker['dates'].append(load_cache_arrays(source)[0]['date'] if isinstance(source, str) else source)
+        _worker['token_ids'].append(np.load(token_path, mmap_mode='r'))
+
+    _worker['token_names'] = np.asarray(token_names)
+
+    # Words are tagged with the symbol : 'RELIANCE:up_b2_h1_t0'
+    _worker['prefixes'] = np.array([f'{symbol}:' for symbol in symbols]) if tag_symbols else None
+
+
+def _write_chunk(task):
+    """
+    Worker : writes the sentences of one range of timestamps to a part file
+
+    Every symbol's tokens in the range are scattered into a (timestamps, symbols) matrix, -1 where a
+    symbol has no candle. Each row is then a bar sentence, or one sentence per group.
+    """
+
+    timestamps = task['timestamps']
+    first_ns, last_ns = timestamps[0], timestamps[-1]
+    token_names, prefixes = _worker['token_names'], _worker['prefixes']
+
+    grid = np.full((len(timestamps), len(_worker['dates'])), -1, dtype=np.int32)
+    for col, (dates, token_ids) in enumerate(zip(_worker['dates'], _worker['token_ids'])):
+        begin, end = np.searchsorted(dates, first_ns, side='left'), np.searchsorted(dates, last_ns, side='right')
+        if begin < end:
+            grid[np.searchsorted(timestamps, dates[begin:end]), col] = token_ids[begin:end]
+
+    num_sentences, num_words = 0, 0
+    with open(task['part_path'], 'w') as f:
+        for columns in task['sentence_columns']:
+            columns = np.asarray(columns)
+            tokens = grid[:, columns]
+            present = tokens >= 0
+            counts = present.sum(axis=1)
+            keep = counts >= task['min_tokens']
+            present &= keep[:, None]
+
+            # Words of the kept sentences, row after row, only the cells of this range are built
+            rows, cols = np.nonzero(present)
+            words = token_names[tokens[rows, cols]]
+            if prefixes is not None:
+                words = np.char.add(prefixes[columns[cols]], words)
+
+            words = words.tolist()
+            ends = np.cumsum(counts[keep]).tolist()
+            for begin, end in zip([0] + ends[:-1], ends):
+                f.write(' '.join(words[begin:end]))
+                f.write('\n')
+
+            num_sentences += len(ends)
+            num_words += len(words)
+
+    return task['part_path'], num_sentences, num_words
+
+
+class MarketCorpus:
+    """
+    Market sentences across the symbols of a Universe : the tokens of many symbols at the same bar
+
+        'bar'   : one sentence per timestamp, the tokens of every symbol that has a candle then
+        'group' : one sentence per timestamp & group (Eg. sector), the tokens of the group's symbols
+
+    Symbols are tokenized one per worker into token arrays on disk, then the timeline is cut into
+    ranges of timestamps that are written as sentences by a process pool & appended to the corpus
+    file in order. A range holds about chunk_cells (timestamps x symbols) tokens, so the memory of a
+    worker is bounded whatever the size of the universe or the length of its history.
+
+        universe = Universe('./data', pattern='*_minute.csv')
+        market = MarketCorpus(universe, CandleTokenizer(), './market.work', groups=symbol2sector)
+        num_sentences, num_words = market.write('./market.txt', mode='group')
+        model, epoch_stats = train_word2vec(None, corpus_path='./market.txt', vector_size=50, window=10)
+    """
+
+    def __init__(self, universe, tokenizer, work_dir, groups=None, tag_symbols=False, min_tokens=2,
+                 processes=None, chunk_cells=5_000_000):
+        """
+        Args:
+            universe (Universe): Symbols to build sentences from
+            tokenizer (CandleTokenizer)
+            work_dir (str): Directory for the token arrays & the part files
+            groups (Dict, optional): symbol -> group name, Eg. sector. Bar sentences list the symbols
+                                     group by group, group sentences leave out ungrouped symbols. Defaults to None.
+            tag_symbols (bool, optional): Words are '<SYMBOL>:<token>' instead of the shared token
+                                          vocabulary. Defaults to False.
+            min_tokens (int, optional): Sentences with fewer tokens are dropped. Defaults to 2.
+            processes (int, optional): Size of the process pool, 1 runs in this process. Defaults to None (num of cores).
+            chunk_cells (int, optional): Timestamps x symbols per range. Defaults to 5_000_000.
+        """
+
+        self.universe = universe
+        self.tokenizer = tokenizer
+        self.work_dir = work_dir
+        self.groups = groups or {}
+        self.tag_symbols = tag_symbols
+        self.min_tokens = min_tokens
+        self.processes = processes
+        self.chunk_cells = chunk_cells
+
+        # Token arrays of a tokenizer config live in their own directory
+        signature = json.dumps({'body_bins': tokenizer.body_bins.tolist(), 'wick_bins': tokenizer.wick_bins.tolist(),
+                                'reference': tokenizer.reference}, sort_keys=True)
+        self.token_dir = os.path.join(work_dir, 'tokens-' + hashlib.sha256(signature.encode()).hexdigest()[:12])
+        os.makedirs(self.token_dir, exist_ok=True)
+
+        # Symbols in sentence order, grouped ones first, group by group
+        self.symbols = sorted(universe.symbols, key=lambda symbol: (symbol not in self.groups, str(self.groups.get(symbol, ''))))
+        self.token_paths = {symbol: os.path.join(self.token_dir, f'{symbol}.npy') for symbol in self.symbols}
+
+
+    def tokenize(self):
+        """
+        Writes the token array of every symbol whose tokens are missing or older than its csv cache
+        (its csv for a symbol the Universe holds in memory, Eg. from a read-only data directory)
+        """
+
+        tasks = []
+        for symbol in self.symbols:
+            token_path = self.token_paths[symbol]
+            csv_path = self.universe.csv_path[symbol]
+
+            if self.universe.cached[symbol]:
+                source, source_path = csv_path, os.path.join(cache_dir_for(csv_path), 'meta.json')
+            else:
+                arrays = self.universe.arrays[symbol]
+                source, source_path = {col: arrays[col] for col in ('open', 'high', 'low', 'close')}, csv_path
+
+            if not os.path.exists(token_path) or os.path.getmtime(token_path) < os.path.getmtime(source_path):
+                tasks.append((source, token_path, self.tokenizer))
+
+        if self.processes == 1 or len(tasks) <= 1:
+            for task in tasks:
+                _tokenize_symbol(task)
+        else:
+            with Pool(processes=self.processes) as pool:
+                for _ in pool.imap_unordered(_tokenize_symbol, tasks, chunksize=4):
+                    pass
+
+
+    def write(self, path, mode='bar'):
+        """
+        Writes the market sentences as a corpus file, one sentence per line (gensim's corpus_file format)
+
+        Args:
+            path (str): Output file
+            mode (str, optional): 'bar' or 'group'. Defaults to 'bar'.
+
+        Returns:
+            num_sentences (int)
+            num_words (int)
+        """
+
+        if mode not in MODES:
+            raise ValueError(f'mode has to be one of {MODES}, got {mode!r}')
+
+        self.tokenize()
+
+        if mode == 'bar':
+            sentence_columns = [list(range(len(self.symbols)))]
+        else:
+            members = {}
+            for col, symbol in enumerate(self.symbols):
+                if symbol in self.groups:
+                    members.setdefault(self.groups[symbol], []).append(col)
+            sentence_columns = list(members.values())
+
+        timestamps = self.universe.timestamps
+        chunk_rows = max(1, self.chunk_cells // max(len(self.symbols), 1))
+        part_dir = os.path.join(self.work_dir, 'parts')
+        os.makedirs(part_dir, exist_ok=True)
+
+        # Workers memory map the cache of a symbol, the dates of an uncached one are sent along
+        sources = [(self.universe.csv_path[symbol] if self.universe.cached[symbol] else self.universe.arrays[symbol]['date'],
+                    self.token_paths[symbol]) for symbol in self.symbols]
+        worker_args = (self.symbols, sources, self.tokenizer.token_names, self.tag_symbols)
+
+        tasks = ({'timestamps'       : timestamps[begin : begin + chunk_rows],
+                  'sentence_columns' : sentence_columns,
+                  'min_tokens'       : self.min_tokens,
+                  'part_path'        : os.path.join(part_dir, f'part-{num:06d}.txt'),
+                  } for num, begin in enumerate(range(0, len(timestamps), chunk_rows)))
+
+        num_sentences, num_words = 0, 0
+
+        # On an error the pool is terminated & the unfinished parts are removed
+        parallel = self.processes != 1
+        pool = Pool(processes=self.processes, initializer=_init_chunk_worker, initargs=worker_args) if parallel \
+            else contextlib.nullcontext()
+        try:
+            with pool:
+                if parallel:
+                    results = pool.imap(_write_chunk, tasks)        # In order, parts are appended as they finish
+                else:
+                    _init_chunk_worker(*worker_args)
+                    results = map(_write_chunk, tasks)
+
+                with open(path, 'w') as out:
+                    for part_path, part_sentences, part_words in results:
+                        with open(part_path) as part:
+                            shutil.copyfileobj(part, out)
+                        os.remove(part_path)
+                        num_sentences += part_sentences
+                        num_words += part_words
+
+        except BaseException:
+            shutil.rmtree(part_dir, ignore_errors=True)
+            raise
+
+        return num_sentences, num_words
@@ -0,0 +1,163 @@
+import numpy as np
+
+from features import FeatureEngine
+
+
+PATTERNS = ['doji', 'hammer', 'bullish_engulfing', 'bearish_engulfing', 'morning_star', 'evening_star']
+
+
+def _lag(values, periods, lookback):
+    """
+    View of <values> lagged by <periods> rows, aligned with values[lookback:] (no copy is made)
+    """
+
+    return values[lookback - periods : len(values) - periods]
+
+
+def _pad(flags, lookback):
+    """
+    Flags of the candles from row <lookback> on, padded with False for the first rows
+    """
+
+    padded = np.zeros(len(flags) + lookback, dtype=bool)
+    padded[lookback:] = flags
+
+    return padded
+
+
+class PatternDetector:
+    """
+    Vectorized candlestick pattern detector, each pattern is a few comparisons between shifted OHLC arrays
+
+    Candle sizes are measured in % of the reference price ('center' or 'ema50'), like the
+    *_per_wrt_* features of Stock.add_additional_features. A multi candle pattern is flagged
+    on its last candle.
+
+        detector = PatternDetector(reference='ema50', doji_body=0.01)
+        flags = detector.detect(stock.data)             # {'doji': bool array, 'hammer': ..., ...}
+        events = detector.events(stock.data, ['morning_star'])
+        stock.data.index[events['morning_star']]
+    """
+
+    def __init__(self, reference='center', doji_body=0.02, small_body=0.05, long_body=0.1,
+                 hammer_tail_ratio=2.0, hammer_head_ratio=0.5, trend_lookback=5, star_gap=False):
+        """
+        Args:
+            reference (str, optional): 'center' or 'ema50'. Defaults to 'center'.
+            doji_body (float, optional): Max body (in %) of a doji. Defaults to 0.02.
+            small_body (float, optional): Max body (in %) of the middle candle of a star. Defaults to 0.05.
+            long_body (float, optional): Min body (in %) of the outer candles of a star. Defaults to 0.1.
+            hammer_tail_ratio (float, optional): Min tail / body of a hammer. Defaults to 2.0.
+            hammer_head_ratio (float, optional): Max head / body of a hammer. Defaults to 0.5.
+            trend_lookback (int, optional): A hammer needs the close before it lower than the close
+                                            trend_lookback candles earlier (a downtrend). Defaults to 5.
+            star_gap (bool, optional): The middle candle of a star has to gap away from the body of the
+                                       first candle (rare in intraday data). Defaults to False.
+        """
+
+        if reference not in ('center', 'ema50'):
+            raise ValueError(f"reference has to be 'center' or 'ema50', got {reference!r}")
+
+        self.reference = reference
+        self.doji_body = doji_body
+        self.small_body = small_body
+        self.long_body = long_body
+        self.hammer_tail_ratio = hammer_tail_ratio
+        self.hammer_head_ratio = hammer_head_ratio
+        self.trend_lookback = trend_lookback
+        self.star_gap = star_gap
+
+
+    def detect(self, ohlc, patterns=None):
+        """
+        Flags every candle that completes a pattern
+
+        Args:
+            ohlc (pandas Dataframe or Dict): has 'open', 'high', 'low', 'close' columns
+                                             ('ema50' is used if present, else computed)
+            patterns (list, optional): Subset of PATTERNS. Defaults to None (all patterns).
+
+        Returns:
+            flags (Dict): pattern name -> bool np.ndarray, one value per candle
+        """
+
+        patterns = list(PATTERNS) if patterns is None else list(patterns)
+
+        unknown = [name for name in patterns if name not in PATTERNS]
+        if unknown:
+            raise ValueError(f'Unknown patterns {unknown}, available patterns are {PATTERNS}')
+
+        o = np.asarray(ohlc['open'], dtype=np.float64)
+        h = np.asarray(ohlc['high'], dtype=np.float64)
+        l = np.asarray(ohlc['low'], dtype=np.float64)
+        c = np.asarray(ohlc['close'], dtype=np.float64)
+
+        if self.reference == 'center':
+            ref = (o + c)/2
+        elif 'ema50' in ohlc:
+            ref = np.asarray(ohlc['ema50'], dtype=np.float64)
+        else:
+            ref = FeatureEngine(['ema50']).compute(ohlc)['ema50']
+
+        n = len(c)
+
+        body = np.abs(c - o)
+        body_per = body/ref*100
+        bullish = c > o
+        bearish = c < o
+
+        flags = {}
+
+        if 'doji' in patterns:
+            flags['doji'] = body_per <= self.doji_body
+
+        if 'hammer' in patterns:
+            k = min(1 + self.trend_lookback, n)
+            head = h[k:] - np.maximum(o[k:], c[k:])
+            tail = np.minimum(o[k:], c[k:]) - l[k:]
+            downtrend = _lag(c, 1, k) < _lag(c, 1 + self.trend_lookback, k)
+            flags['hammer'] = _pad((tail >= self.hammer_tail_ratio*body[k:]) & (head <= self.hammer_head_ratio*body[k:])
+                                   & (tail > 0) & downtrend, k)
+
+        if 'bullish_engulfing' in patterns or 'bearish_engulfing' in patterns:
+            k = min(1, n)
+            o1, c1 = _lag(o, 1, k), _lag(c, 1, k)
+            top, bottom = np.maximum(o[k:], c[k:]), np.minimum(o[k:], c[k:])
+            engulfs = (top >= np.maximum(o1, c1)) & (bottom <= np.minimum(o1, c1)) & (body[k:] > _lag(body, 1, k))
+
+            if 'bullish_engulfing' in patterns:
+                flags['bullish_engulfing'] = _pad(engulfs & bullish[k:] & (c1 < o1), k)
+            if 'bearish_engulfing' in patterns:
+                flags['bearish_engulfing'] = _pad(engulfs & bearish[k:] & (c1 > o1), k)
+
+        if 'morning_star' in patterns or 'evening_star' in patterns:
+            k = min(2, n)
+            o2, c2 = _lag(o, 2, k), _lag(c, 2, k)
+            o1, c1 = _lag(o, 1, k), _lag(c, 1, k)
+            shape = (_lag(body_per, 2, k) >= self.long_body) & (_lag(body_per, 1, k) <= self.small_body) & (body_per[k:] >= self.long_body)
+            first_mid = (o2 + c2)/2
+
+            if 'morning_star' in patterns:
+                star = shape & (c2 < o2) & bullish[k:] & (c[k:] > first_mid)
+                if self.star_gap:
+                    star &= np.maximum(o1, c1) < c2
+                flags['morning_star'] = _pad(star, k)
+
+            if 'evening_star' in patterns:
+                star = shape & (c2 > o2) & bearish[k:] & (c[k:] < first_mid)
+                if self.star_gap:
+                    star &= np.minimum(o1, c1) > c2
+                flags['evening_star'] = _pad(star, k)
+
+        return {name : flags[name] for name in patterns}
+
+
+    def events(self, ohlc, patterns=None):
+        """
+        Row positions of the candles that complete each pattern
+
+        Returns:
+            events (Dict): pattern name -> int64 np.ndarray of row positions
+        """
+
+        return {name : np.flatnonzero(flag) for name, flag in self.detect(ohlc, patterns).items()}
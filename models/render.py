@@ -0,0 +1,214 @@
+import contextlib
+import io
+import os
+from multiprocessing import Pool
+
+import matplotlib.image as plt_image
+import matplotlib.patches as patches
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+
+class CandleRenderer:
+    """
+    Off-screen renderer of candle images, in the style of Visualiser.plot1candle
+
+    One Agg figure & one set of artists is created up front. The axes are drawn once & kept as a
+    background, candles are scaled into fixed axis limits so a render only restores the background
+    & redraws the candle artists (blitting). Thousands of images cost no figure creation and never
+    touch a display. Prices are not on the y axis, every image is scaled to its own candles.
+
+        renderer = CandleRenderer(window=1)
+        image = renderer.render(o, h, l, c)         # (height, width, 3) uint8
+        png = renderer.render_png(o, h, l, c)       # PNG bytes
+    """
+
+    def __init__(self, window=1, figsize=None, dpi=50, grid=True):
+        """
+        Args:
+            window (int, optional): Num of candles per image. Defaults to 1.
+            figsize (tuple, optional): (width,height) inches. Defaults to None ((2, 5) for 1 candle, wider for more).
+            dpi (int, optional): Pixels per inch. Defaults to 50.
+            grid (bool, optional): Draw gridlines behind the candles. Defaults to True.
+        """
+
+        self.window = window
+        self.dpi = dpi
+        figsize = figsize or (max(2, window * 0.6), 5)
+
+        self.figure = Figure(figsize=figsize, dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot()
+
+        # Artists of every candle slot, only their data changes between renders
+        self.bodies = []
+        self.wicks = []
+        for i in range(window):
+            body = patches.Rectangle((i - .25, 0), width=.5, height=0, linewidth=3,
+                                     edgecolor='black', facecolor='yellowgreen', zorder=2)
+            self.ax.add_patch(body)
+            self.bodies.append(body)
+
+            wick, = self.ax.plot([i, i], [0, 0], color='black', linewidth=2, zorder=1,
+                                 marker='o', markersize=4)      # Line(wick) with dots at the wicks end
+            self.wicks.append(wick)
+
+            body.set_animated(True)
+            wick.set_animated(True)
+
+        self.ax.set_xlim(-.75, window - .25)
+        self.ax.set_ylim(0, 1)
+        self.ax.set_xticks([])
+        self.ax.set_yticklabels([])
+        self.ax.set_axisbelow(True)
+        self.ax.grid(grid)
+
+        # Everything but the candles, restored before every render
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self.shape = np.asarray(self.canvas.buffer_rgba()).shape[:2] + (3,)
+
+
+    def _update(self, o, h, l, c):
+
+        o, h, l, c = (np.atleast_1d(np.asarray(x, dtype=np.float64)) for x in (o, h, l, c))
+
+        # Same framing as plot1candle, (low - range/3, high + range/3) scaled to the (0, 1) axis
+        low, high = l.min(), h.max()
+        range_abs = (high - low) or max(abs(high) * 1e-4, 1e-4)
+        bottom, span = low - range_abs/3, range_abs*5/3
+        o, h, l, c = ((x - bottom)/span for x in (o, h, l, c))
+
+        for i, body in enumerate(self.bodies):
+            body.set_y(o[i])
+            body.set_height(c[i] - o[i])
+            body.set_facecolor('yellowgreen' if c[i] > o[i] else 'crimson')
+            self.wicks[i].set_ydata([l[i], h[i]])
+
+        self.canvas.restore_region(self.background)
+        for body, wick in zip(self.bodies, self.wicks):
+            self.ax.draw_artist(wick)
+            self.ax.draw_artist(body)
+
+
+    def render(self, o, h, l, c):
+        """
+        Renders <window> candles into an RGB array
+
+        Args:
+            o, h, l, c (np.ndarray): OHLC of the candles, <window> values each
+
+        Returns:
+            image (np.ndarray): (height, width, 3) uint8
+        """
+
+        self._update(o, h, l, c)
+
+        return np.asarray(self.canvas.buffer_rgba())[..., :3].copy()
+
+
+    def render_png(self, o, h, l, c):
+        """
+        Renders <window> candles into PNG bytes
+        """
+
+        buffer = io.BytesIO()
+        plt_image.imsave(buffer, self.render(o, h, l, c), format='png')
+
+        return buffer.getvalue()
+
+
+def _render_chunk(args):
+    """
+    Worker : renders one chunk of windows, into the array store or as PNG files
+    """
+
+    ohlc, starts, rows, window, renderer_kwargs, array_path, out_dir, names = args
+
+    renderer = CandleRenderer(window=window, **renderer_kwargs)
+    store = np.load(array_path, mmap_mode='r+') if array_path is not None else None
+    images = []
+
+    o, h, l, c = ohlc
+    for start, row, name in zip(starts, rows, names):
+        candles = slice(start, start + window)
+
+        if out_dir is not None:
+            with open(os.path.join(out_dir, name), 'wb') as f:
+                f.write(renderer.render_png(o[candles], h[candles], l[candles], c[candles]))
+        else:
+            image = renderer.render(o[candles], h[candles], l[candles], c[candles])
+            if store is not None:
+                store[row] = image
+            else:
+                images.append(image)
+
+    if store is not None:
+        store.flush()
+
+    return rows, images
+
+
+def render_batch(stock, target_datetimes, window=1, out_dir=None, array_path=None,
+                 processes=None, chunk_size=256, **renderer_kwargs):
+    """
+    Renders a window of candles starting at each target datetime, off-screen
+
+    Exactly one output is used :
+        out_dir    : one PNG per window, '<num>_<YYYYmmdd_HHMM>.png'
+        array_path : a (num windows, height, width, 3) uint8 .npy array store, workers write into it directly
+        neither    : the same array, returned in memory
+
+    Args:
+        stock (Stock)
+        target_datetimes (array-like of datetimes): First candle of each window (exact or nearest previous)
+        window (int, optional): Num of candles per image. Defaults to 1.
+        out_dir (str, optional): Directory for PNG files. Defaults to None.
+        array_path (str, optional): Path of the .npy array store. Defaults to None.
+        processes (int, optional): Size of the process pool, 1 renders in this process. Defaults to None (num of cores).
+        chunk_size (int, optional): Num of windows per worker task. Defaults to 256.
+        **renderer_kwargs: Passed on to CandleRenderer (figsize, dpi, grid)
+
+    Returns:
+        images (np.ndarray or None): the in-memory array, the memory mapped store, or None for PNG output
+    """
+
+    starts = np.atleast_1d(stock.get_datetime_positions(target_datetimes))
+    if np.any(starts < 0) or np.any(starts + window > len(stock.data)):
+        raise ValueError(f'Every target datetime needs {window} candles at or after it in the data')
+
+    ohlc = tuple(stock.data[col].to_numpy() for col in ('open', 'high', 'low', 'close'))
+    stamps = stock.data.index[starts].strftime('%Y%m%d_%H%M')
+    names = [f'{i:06d}_{stamp}.png' for i, stamp in enumerate(stamps)]
+
+    shape = (len(starts),) + CandleRenderer(window=window, **renderer_kwargs).shape
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok=True)
+    elif array_path is not None:
+        np.lib.format.open_memmap(array_path, mode='w+', dtype=np.uint8, shape=shape).flush()
+
+    # Every task only carries the candles its windows need
+    tasks = []
+    for begin in range(0, len(starts), chunk_size):
+        chunk = starts[begin : begin + chunk_size]
+        lo, hi = chunk.min(), chunk.max() + window
+        tasks.append((tuple(x[lo:hi] for x in ohlc), chunk - lo, np.arange(begin, begin + len(chunk)), window,
+                      renderer_kwargs, array_path if out_dir is None else None, out_dir, names[begin : begin + len(chunk)]))
+
+    images = np.empty(shape, dtype=np.uint8) if out_dir is None and array_path is None else None
+
+    # The pool is shut down even if a worker raises
+    parallel = processes != 1 and len(tasks) > 1
+    with Pool(processes=processes) if parallel else contextlib.nullcontext() as pool:
+        results = pool.imap_unordered(_render_chunk, tasks) if parallel else map(_render_chunk, tasks)
+        for rows, chunk_images in results:
+            if images is not None:
+                images[rows] = chunk_images
+
+    if out_dir is not None:
+        return None
+    if array_path is not None:
+        return np.load(array_path, mmap_mode='r')
+
+    return images
@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+
+
+NS_PER_MIN = 60 * 10**9
+NS_PER_DAY = 1440 * NS_PER_MIN
+SESSION_OPEN_MIN = 9*60 + 15        # 9:15, bars are anchored at market open
+
+TIMEFRAMES = [3, 5, 15, 30, 60, 'day']
+
+
+def local_ns(index):
+    """
+    int64 nanoseconds of local (exchange) wall clock time of a DatetimeIndex, tz is dropped without shifting
+    """
+
+    if index.tz is not None:
+        index = index.tz_localize(None)
+
+    return index.as_unit('ns').asi8
+
+
+def bucket_ids(index_ns, timeframe):
+    """
+    Bar each candle falls in, bars of <timeframe> minutes start at 9:15 & never cross a day
+
+    Args:
+        index_ns (np.ndarray): Sorted int64 local nanoseconds, see local_ns
+        timeframe (int or str): Bar size in minutes, or 'day'
+
+    Returns:
+        buckets (np.ndarray): int64, non decreasing, equal for candles of the same bar
+        bar_start_ns (callable): bucket id -> local nanoseconds the bar starts at
+    """
+
+    day = index_ns // NS_PER_DAY
+
+    if timeframe == 'day':
+        return day, lambda bucket: bucket * NS_PER_DAY
+
+    # Signed num of bars from 9:15, negative for candles before it, kept within the day by an offset
+    minute_of_day = (index_ns - day * NS_PER_DAY) // NS_PER_MIN
+    bars_before_open = -(-SESSION_OPEN_MIN // timeframe)
+    bars_per_day = bars_before_open - (-(1440 - SESSION_OPEN_MIN) // timeframe)
+
+    buckets = day * bars_per_day + (minute_of_day - SESSION_OPEN_MIN) // timeframe + bars_before_open
+
+    def bar_start_ns(bucket):
+        bar_day, bar = np.divmod(bucket, bars_per_day)
+        minute = SESSION_OPEN_MIN + (bar - bars_before_open) * timeframe
+        return bar_day * NS_PER_DAY + np.maximum(minute, 0) * NS_PER_MIN        # The first bar starts at midnight
+
+    return buckets, bar_start_ns
+
+
+def resample_ohlcv(data, timeframe):
+    """
+    Aggregates OHLCV candles into larger bars in one vectorized pass
+    open : first, high : max, low : min, close : last, volume : sum (other columns are dropped)
+
+    Args:
+        data (pandas Dataframe): datetime indexed & sorted, has 'open', 'high', 'low', 'close' (& 'volume')
+        timeframe (int or str): Bar size in minutes, anchored at 9:15, or 'day'
+
+    Returns:
+        bars (pandas Dataframe): indexed by the start time of each bar (midnight for 'day'),
+                                 with a 'candles' column holding the num of candles in the bar
+    """
+
+    if timeframe != 'day' and (not isinstance(timeframe, (int, np.integer)) or timeframe < 1):
+        raise ValueError(f"timeframe has to be a num of minutes or 'day', got {timeframe!r}")
+
+    buckets, bar_start_ns = bucket_ids(local_ns(data.index), timeframe)
+
+    # First row of every bar, the data is sorted so a bar is a run of equal bucket ids
+    starts = np.flatnonzero(np.diff(buckets, prepend=buckets[:1] - 1))
+
+    index = pd.DatetimeIndex(bar_start_ns(buckets[starts]).view('M8[ns]'), name=data.index.name)
+    if data.index.tz is not None:
+        index = index.tz_localize(data.index.tz)
+
+    return _aggregate(data, starts, index)
+
+
+def downsample_rows(data, factor):
+    """
+    Aggregates every <factor> consecutive rows into one bar, regardless of time
+    Eg. daily bars into ~weekly bars, when even daily bars are too many to plot
+
+    Args:
+        data (pandas Dataframe): OHLCV bars or candles
+        factor (int): Num of rows per bar
+
+    Returns:
+        bars (pandas Dataframe): indexed by the time of the first row of each bar
+    """
+
+    starts = np.arange(0, len(data), max(int(factor), 1))
+
+    return _aggregate(data, starts, data.index[starts])
+
+
+def _aggregate(data, starts, index):
+    """
+    OHLCV of the runs of rows [starts[i], starts[i+1]), the last run goes to the end of data
+    """
+
+    ends = np.append(starts[1:], len(data))
+
+    columns = ['open', 'high', 'low', 'close'] + (['volume'] if 'volume' in data else [])
+    if not len(starts):
+        empty = {col: data[col].to_numpy()[:0] for col in columns}
+        empty['candles'] = np.empty(0, dtype=np.int64)
+        return pd.DataFrame(empty, index=index)
+
+    bars = {'open'  : data['open'].to_numpy()[starts],
+            'high'  : np.maximum.reduceat(data['high'].to_numpy(), starts),
+            'low'   : np.minimum.reduceat(data['low'].to_numpy(), starts),
+            'close' : data['close'].to_numpy()[ends - 1],
+            }
+    if 'volume' in data:
+        bars['volume'] = np.add.reduceat(data['volume'].to_numpy(), starts)
+
+    # Bars built from bars carry their candle count along
+    counts = data['candles'].to_numpy() if 'candles' in data else np.ones(len(data), dtype=np.int64)
+    bars['candles'] = np.add.reduceat(counts, starts)
+
+    return pd.DataFrame(bars, index=index)
@@ -0,0 +1,274 @@
+import json
+import os
+
+import numpy as np
+
+
+def token_vectors(model, token_names):
+    """
+    Word2Vec vectors in token id order, as one float32 matrix
+
+    Args:
+        model (gensim.models.Word2Vec): trained on words of token_names
+        token_names (np.ndarray): token id -> word, Eg. CandleTokenizer.token_names
+
+    Returns:
+        vectors (np.ndarray): (vocab size, vector size) float32, zero rows for tokens the model never saw
+    """
+
+    vectors = np.zeros((len(token_names), model.wv.vector_size), dtype=np.float32)
+
+    for token_id, word in enumerate(token_names):
+        if word in model.wv.key_to_index:
+            vectors[token_id] = model.wv[word]
+
+    return vectors
+
+
+def pool_windows(vectors, windows):
+    """
+    Embeddings of token windows, the mean of their token vectors scaled to unit length
+
+    Args:
+        vectors (np.ndarray): (vocab size, vector size) token id -> vector
+        windows (np.ndarray): (num windows, window) token ids
+
+    Returns:
+        embeddings (np.ndarray): (num windows, vector size) float32
+    """
+
+    embeddings = vectors[windows].mean(axis=1, dtype=np.float32)
+
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    np.divide(embeddings, norms, out=embeddings, where=norms > 0)
+
+    return embeddings
+
+
+def _spherical_kmeans(samples, num_clusters, iterations, rng):
+    """
+    k-means on unit vectors with cosine similarity, returns (num_clusters, vector size) unit centroids
+    """
+
+    centroids = samples[rng.choice(len(samples), num_clusters, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = np.argmax(samples @ centroids.T, axis=1)
+
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, samples)
+
+        # Empty clusters restart from a random sample
+        empty = np.flatnonzero(np.bincount(labels, minlength=num_clusters) == 0)
+        sums[empty] = samples[rng.choice(len(samples), len(empty), replace=False)]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums/np.where(norms > 0, norms, 1)
+
+    return centroids.astype(np.float32)
+
+
+class WindowIndex:
+    """
+    Nearest neighbour search over the embeddings of every window of a corpus
+
+    The index is a directory with a float32 (num windows, vector size) matrix of unit length window
+    embeddings, the candle position each window starts at & its start time, all memory mapped on open.
+    A query is a cosine similarity top-k, a BLAS matrix-vector product per chunk of rows.
+
+    Built with num_lists the index is an IVF (inverted file) : windows are clustered around num_lists
+    centroids & stored list by list, a query only scores the nprobe lists closest to it. On tens of
+    millions of windows this is approximate but orders of magnitude less work than the full scan.
+
+        vectors = token_vectors(model, tokenizer.token_names)      # or EmbeddingStore(path).vectors
+        corpus = WindowCorpus.from_stock(stock, tokenizer, window=10)
+        index = WindowIndex.build('./windows.idx', vectors, corpus)
+
+        last10 = corpus.token_ids[-index.window:]                   # as long as the indexed windows
+        positions, scores, times = index.query_tokens(last10, vectors, k=50)
+        times               # when the 50 most similar windows started, exchange local time
+
+    Positions are candle positions of the corpus, rows of stock.data only for a corpus of the stock's
+    own candles (not one built with a timeframe), the times hold either way.
+
+        index = WindowIndex.build('./windows.ivf', vectors, corpus, num_lists=4096)
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Directory written by WindowIndex.build
+        """
+
+        self.path = path
+
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+
+        self.embeddings = np.load(os.path.join(path, 'embeddings.npy'), mmap_mode='r')
+        self.starts = np.load(os.path.join(path, 'starts.npy'), mmap_mode='r')
+        self.window = self.meta['window']
+
+        # int64 exchange local nanoseconds each window starts at, for a corpus with candle times
+        start_ns_path = os.path.join(path, 'start_ns.npy')
+        self.start_ns = np.load(start_ns_path, mmap_mode='r') if os.path.exists(start_ns_path) else None
+
+        self.centroids = None           # (num lists, vector size), IVF index only
+        self.list_offsets = None        # rows [list_offsets[i], list_offsets[i+1]) belong to list i
+        if self.meta.get('num_lists'):
+            self.centroids = np.load(os.path.join(path, 'centroids.npy'))
+            self.list_offsets = np.load(os.path.join(path, 'list_offsets.npy'))
+
+
+    @classmethod
+    def build(cls, path, vectors, corpus, chunk_size=16384, num_lists=None, train_size=100_000, iterations=10, seed=0):
+        """
+        Embeds every window of <corpus> and writes the index, a chunk of windows at a time
+
+        Args:
+            path (str): Output directory
+            vectors (np.ndarray): (vocab size, vector size) token id -> vector, see token_vectors
+            corpus (WindowCorpus): Windows to index, the hits have times if it has candle times (WindowCorpus.from_stock)
+            chunk_size (int, optional): Num of windows embedded at a time. Defaults to 16384.
+            num_lists (int, optional): Num of IVF lists, Eg. ~sqrt(num windows). Defaults to None (full scan index).
+            train_size (int, optional): Num of windows the IVF centroids are fitted on. Defaults to 100_000.
+            iterations (int, optional): k-means iterations. Defaults to 10.
+            seed (int, optional): Seed of the k-means sampling. Defaults to 0.
+
+        Returns:
+            index (WindowIndex)
+        """
+
+        os.makedirs(path, exist_ok=True)
+        embeddings_path = os.path.join(path, 'embeddings.npy')
+        starts = np.asarray(corpus.starts, dtype=np.int64)
+        start_ns = None if corpus.candle_ns is None else np.asarray(corpus.candle_ns, dtype=np.int64)[starts]
+
+        embeddings = np.lib.format.open_memmap(embeddings_path, mode='w+', dtype=np.float32,
+                                               shape=(len(corpus), vectors.shape[1]))
+
+        row = 0
+        for windows in corpus.iter_chunks(chunk_size):
+            embeddings[row : row + len(windows)] = pool_windows(vectors, windows)
+            row += len(windows)
+
+        embeddings.flush()
+
+        meta = {'window': corpus.window, 'num_windows': len(corpus), 'vector_size': int(vectors.shape[1]),
+                'num_lists': None}
+
+        if num_lists:
+            num_lists = min(num_lists, len(corpus))
+            rng = np.random.default_rng(seed)
+
+            sample = np.sort(rng.choice(len(corpus), min(train_size, len(corpus)), replace=False))
+            centroids = _spherical_kmeans(np.asarray(embeddings[sample]), num_lists, iterations, rng)
+
+            labels = np.concatenate([np.argmax(embeddings[begin : begin + chunk_size] @ centroids.T, axis=1)
+                                     for begin in range(0, len(corpus), chunk_size)])
+
+            # Store the windows list by list
+            order = np.argsort(labels, kind='stable')
+            list_offsets = np.searchsorted(labels[order], np.arange(num_lists + 1))
+
+            sorted_path = os.path.join(path, 'embeddings.sorted.npy')
+            sorted_embeddings = np.lib.format.open_memmap(sorted_path, mode='w+', dtype=np.float32, shape=embeddings.shape)
+            for begin in range(0, len(corpus), chunk_size):
+                sorted_embeddings[begin : begin + chunk_size] = embeddings[order[begin : begin + chunk_size]]
+
+            sorted_embeddings.flush()
+            del sorted_embeddings
+            os.replace(sorted_path, embeddings_path)
+
+            starts = starts[order]
+            if start_ns is not None:
+                start_ns = start_ns[order]
+            np.save(os.path.join(path, 'centroids.npy'), centroids)
+            np.save(os.path.join(path, 'list_offsets.npy'), list_offsets)
+            meta['num_lists'] = int(num_lists)
+
+        del embeddings
+
+        np.save(os.path.join(path, 'starts.npy'), starts)
+        if start_ns is not None:
+            np.save(os.path.join(path, 'start_ns.npy'), start_ns)
+
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+        return cls(path)
+
+
+    def __len__(self):
+
+        return len(self.starts)
+
+
+    def query(self, embedding, k=50, nprobe=8, chunk_rows=1_000_000):
+        """
+        The k windows most similar (cosine) to an embedding
+
+        Args:
+            embedding (np.ndarray): (vector size,) query embedding, Eg. from pool_windows
+            k (int, optional): Num of hits. Defaults to 50.
+            nprobe (int, optional): Num of IVF lists searched, ignored by a full scan index. Defaults to 8.
+            chunk_rows (int, optional): Rows scored per matrix-vector product. Defaults to 1_000_000.
+
+        Returns:
+            positions (np.ndarray): Candle position (in the corpus) each hit window starts at, most similar first
+            scores (np.ndarray): Cosine similarity of each hit
+            times (np.ndarray): datetime64[ns] exchange local time each hit window starts at,
+                                None if the corpus had no candle times
+        """
+
+        query = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query/norm
+
+        # Row ranges to score : everything, or the lists whose centroids are closest to the query
+        if self.centroids is None:
+            ranges = [(begin, min(begin + chunk_rows, len(self))) for begin in range(0, len(self), chunk_rows)]
+        else:
+            probe = np.argsort(-(self.centroids @ query))[:nprobe]
+            ranges = [(self.list_offsets[i], self.list_offsets[i + 1]) for i in probe]
+
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+
+        for begin, end in ranges:
+            scores = self.embeddings[begin : end] @ query
+
+            # Top k of this range, merged with the running top k
+            top = np.argpartition(scores, -k)[-k:] if len(scores) > k else np.arange(len(scores))
+            best_rows = np.concatenate([best_rows, top + begin])
+            best_scores = np.concatenate([best_scores, scores[top]])
+
+            if len(best_rows) > k:
+                keep = np.argpartition(best_scores, -k)[-k:]
+                best_rows, best_scores = best_rows[keep], best_scores[keep]
+
+        order = np.argsort(-best_scores, kind='stable')
+        rows = best_rows[order]
+
+        times = None if self.start_ns is None else np.asarray(self.start_ns[rows]).view('M8[ns]')
+
+        return np.asarray(self.starts[rows]), best_scores[order], times
+
+
+    def query_tokens(self, token_ids, vectors, k=50, **kwargs):
+        """
+        The k windows most similar to a window of token ids, Eg. the last 20 candles
+
+        Args:
+            token_ids (np.ndarray): Token ids of the query window
+            vectors (np.ndarray): token id -> vector, the ones the index was built with
+            k (int, optional): Num of hits. Defaults to 50.
+
+        Returns:
+            positions, scores, times : see query
+        """
+
+        embedding = pool_windows(vectors, np.asarray(token_ids)[None, :])[0]
+
+        return self.query(embedding, k=k, **kwargs)
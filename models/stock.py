@@ -1,31 +1,126 @@
 import datetime
 import math
-from collections import OrderedDict
-from multiprocessing import Pool
+import os
+import re
 
 import numpy as np
 import pandas as pd
 
+from buffer import ColumnBuffer
+from cache import read_cached_df, write_cache
+from features import FeatureEngine
+from instrument import span
+from resample import TIMEFRAMES, local_ns, resample_ohlcv
+from utils import compact_ohlcv
 
-class Stock:
+
+NS_PER_SEC = 10**9
+NS_PER_DAY = 86400 * NS_PER_SEC
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()    # day keys are counted from the unix epoch
+SESSION_OPEN_NS = (9*60 + 15) * 60 * NS_PER_SEC            # 9:15, market open
+
+
+class SymbolRegistry:
+    """
+    NSE symbol -> company name table, loaded from EQUITY_L.csv the first time it is needed
+    File names are resolved to symbols through a set lookup on their tokens instead of scanning every symbol
+    """
     
-    EQUITY_L_PATH = './DATA/EQUITY_L.csv'
+    def __init__(self, equity_l_path):
+        
+        self.equity_l_path = equity_l_path
+        self._symbol2name = None
+        
+        
+    @property
+    def symbol2name(self):
+        """
+        Dict of NSE SYMBOL -> NAME OF COMPANY, empty if the EQUITY_L file is not present
+        """
+        
+        if self._symbol2name is None:
+            self._symbol2name = self._load()
+            
+        return self._symbol2name
     
-    df_equity = pd.read_csv(EQUITY_L_PATH) # NSE SYMBOL AND NAME DATASET
-    df_equity = df_equity[['SYMBOL', 'NAME OF COMPANY']]
-    df_equity = df_equity.rename(columns={'SYMBOL': 'symbol', 'NAME OF COMPANY': 'company_name'})
     
-    symbol2name = { symbol : name for symbol, name in zip(df_equity.symbol, df_equity.company_name) }
+    def _load(self):
+        
+        if not os.path.exists(self.equity_l_path):
+            return {}
+        
+        df_equity = pd.read_csv(self.equity_l_path, usecols=['SYMBOL', 'NAME OF COMPANY']) # NSE SYMBOL AND NAME DATASET
+        
+        return {symbol.upper() : name for symbol, name in zip(df_equity['SYMBOL'], df_equity['NAME OF COMPANY'])}
     
     
+    def resolve(self, csv_path):
+        """
+        Finds the NSE symbol a csv file belongs to, from its file name
+        
+        The file name (without extension) is split on '_' and whitespace, and every run of
+        consecutive tokens is looked up in the symbol table, longest run first.
+        Eg. 'RELIANCE_minute.csv' -> 'RELIANCE', 'BAJAJ-AUTO_day.csv' -> 'BAJAJ-AUTO'
+        
+        Args:
+            csv_path (str): Path to csv file
+        
+        Returns:
+            symbol (str or None): None if no symbol matches
+        """
+        
+        symbol2name = self.symbol2name
+        
+        stem = os.path.splitext(os.path.basename(os.fspath(csv_path)))[0].upper()
+        tokens = re.split(r'[_\s]+', stem)
+        
+        for length in range(len(tokens), 0, -1):
+            for start in range(len(tokens) - length + 1):
+                candidate = '_'.join(tokens[start : start+length])
+                if candidate in symbol2name:
+                    return candidate
+        
+        return None
+
+
+_symbol_registries = {}
+
+def get_symbol_registry(equity_l_path):
+    """
+    Process wide SymbolRegistry for <equity_l_path>, created (but not loaded) on first use
+    """
     
-    def __init__(self, csv_path, remove_incomplete_days=True):
+    if equity_l_path not in _symbol_registries:
+        _symbol_registries[equity_l_path] = SymbolRegistry(equity_l_path)
+        
+    return _symbol_registries[equity_l_path]
+
+
+
+class Stock:
+    
+    EQUITY_L_PATH = './DATA/EQUITY_L.csv'   # NSE SYMBOL AND NAME DATASET, read lazily by SymbolRegistry
+    
+    
+    def __init__(self, csv_path, remove_incomplete_days=True, use_cache=True, compact=False):
+        
+        # Every stage is timed, see models/instrument.py
+        with span('stock.init') as init_span:
+            self._init(csv_path, remove_incomplete_days, use_cache, compact)
+            init_span.rows = self.total_candles
+            
+            
+    def _init(self, csv_path, remove_incomplete_days, use_cache, compact):
         
         self.csv_path = csv_path    
-        self.data = self.read_df(self.csv_path)             # OHLC dataframe
+        self.data = self.read_df(self.csv_path, use_cache=use_cache)     # OHLC dataframe
+        
+        # Compact mode : float32 prices, sized integer volume & float32 features (see utils.compact_ohlcv)
+        self.compact = compact
+        if compact:
+            self.data = compact_ohlcv(self.data)
         
         self.total_candles = len(self.data)                 # Num of Candlesticks in the dataset
-        self.traded_days = len(set(self.data.index.date))   # Num days market was open
         
         self.cdst_duration_secs = None      # candlestick duration in seconds
         self.cdst_duration_mins = None      # candlestick duration in minutes
@@ -33,15 +128,32 @@ class Stock:
         self._setup_durations()             
         
         self.cdst_per_day =  math.ceil((375*60)/self.cdst_duration_secs)    # candlesticks per day. 1day = 375*60 secs
+        
+        self.day_keys = None                # Day table, one entry per traded day (see _build_day_table)
+        self.day_starts = None
+        self.day_ends = None
+        self.day_counts = None
+        self.day_is_full = None
+        self._day_lookup = None
+        self._index_ns = None               # tz-naive int64 index (exchange local time), for searchsorted lookups
+        self._resampled = {}                # timeframe -> bars, cached views of self.data (see resample)
+        self._buffer = None                 # Growable storage of self.data, created by the first append_candles
+        self._day_buffer = None             # Growable storage of the day table
+        self._buffer_index = None           # Index of the last self.data built over self._buffer
+        with span('stock.index_data', rows=self.total_candles):
+            self._index_data()
+        
+        self.traded_days = len(self.day_keys)               # Num days market was open
        
-        self.incomplete_day_dates = None            # Num days that dont have full data (375 mins)
-        #self._get_incomplete_days(verbose=False)   # This takes time, do not use if incomplete days are already removed        
+        self.incomplete_day_dates = None            # Dates that dont have full data (375 mins)
+        self._get_incomplete_days(verbose=False)    # Single vectorized pass over the index
         
         if remove_incomplete_days:
             
             #print("\nINITIALLY")
             #print(f'TOTAL CANDLES : {self.total_candles} , TOTAL TRADED DAYS : {self.traded_days}\n' )
-            self._remove_incomplete_days()
+            with span('stock.remove_incomplete_days', rows=self.total_candles):
+                self._remove_incomplete_days()
             #print("REMOVED INCOMPLETE DAYS")
             #print(f'TOTAL CANDLES : {self.total_candles} , TOTAL TRADED DAYS : {self.traded_days}\n' )
             
@@ -50,18 +162,53 @@ class Stock:
         self.company_name = None            
         self._extract_symbol_and_name()
         
+        self.feature_engine = None          # Set by add_additional_features
+        
       
-    def read_df(self, csv_path):
+    @staticmethod
+    def read_df(csv_path, use_cache=True):
         
         """
         Reads csv file to return dataframe
         dataframe has columns [date, open, high, low, close]
+        
+        With use_cache the normalised data is also written to a binary cache next to the csv
+        (see models/cache.py). Later reads memory map the cache instead of parsing the csv,
+        the cache is rebuilt whenever the mtime or size of the csv changes.
+        
         Args:
             csv_path (str): Path to csv file
+            use_cache (bool, optional): Read from / write to the binary cache. Defaults to True.
         Returns:
             df (pandas Dataframe)
         """
         
+        # Warm load : zero-copy views on the memory mapped cache
+        if use_cache:
+            with span('stock.read_cache') as read_span:
+                df = read_cached_df(csv_path)
+                read_span.rows = None if df is None else len(df)
+            if df is not None:
+                return df
+        
+        with span('stock.parse_csv') as parse_span:
+            df = Stock._parse_csv(csv_path)
+            parse_span.rows = len(df)
+        
+        # Cold load : store the parsed frame, a read-only data directory just means no cache
+        if use_cache:
+            with span('stock.write_cache', rows=len(df)):
+                try:
+                    write_cache(csv_path, df)
+                except OSError:
+                    pass
+        
+        return df
+    
+    
+    @staticmethod
+    def _parse_csv(csv_path):
+        
         # Read Dataframe
         df = pd.read_csv(csv_path)
         
@@ -81,6 +228,10 @@ class Stock:
         df['date'] = pd.to_datetime(df['date'])
         df.set_index('date', inplace=True)
         
+        # Per day computations run-length encode the index, they need it in order
+        if not df.index.is_monotonic_increasing:
+            df.sort_index(inplace=True, kind='stable')
+        
         return df
     
 
@@ -103,48 +254,306 @@ class Stock:
                 'is_fullday'     : False,
                 }
         
-        # The indices where the date part matches the target_date
-        matched_indices = self.data.index[self.data.index.date == target_date]
+        # Position of the day in the day table
+        pos = self._day_position(target_date)
         
         # If there is a match
-        if len(matched_indices)>0:
+        if pos >= 0:
             
             info['day_exists'] = True
-            info['first_datetime'] = matched_indices[0]
-            info['last_datetime'] = matched_indices[-1]
-            info['num_candles'] = len(matched_indices)
-            
-            # If full day of trading happened
-            if (info['last_datetime'] - info['first_datetime']) == datetime.timedelta(hours=6, minutes=14):
-                info['is_fullday'] = True
+            info['first_datetime'] = self.data.index[self.day_starts[pos]]
+            info['last_datetime'] = self.data.index[self.day_ends[pos] - 1]
+            info['num_candles'] = int(self.day_counts[pos])
+            info['is_fullday'] = bool(self.day_is_full[pos])
             
         return info
     
     
-    def add_additional_features(self):
+    def get_day(self, target_date):
+        """
+        Candles of a single day, a slice of self.data (no copy is made)
         
-        self.data['ema50'] = self.data['close'].ewm(span=50, adjust=False).mean()
-
-        self.data['center'] = (self.data['open'] + self.data['close'])/2
-
-        self.data['head'] = self.data['high'] -  self.data[['open', 'close']].max(axis=1) 
-        self.data['tail'] =  self.data[['open', 'close']].min(axis=1) - self.data['low']
-        self.data['body'] = np.abs(self.data['open'] - self.data['close'])
-        self.data['range'] = np.abs(self.data['high'] - self.data['low'])
-
-        self.data['head_per_wrt_ema50'] = (self.data['head']/self.data['ema50'])*100
-        self.data['tail_per_wrt_ema50'] = (self.data['tail']/self.data['ema50'])*100
-        self.data['body_per_wrt_ema50'] = (self.data['body']/self.data['ema50'])*100
-
-        self.data['head_per_wrt_center'] = (self.data['head']/self.data['center'])*100
-        self.data['tail_per_wrt_center'] = (self.data['tail']/self.data['center'])*100
-        self.data['body_per_wrt_center'] = (self.data['body']/self.data['center'])*100
+        Args:
+            target_date (datetime.date): Eg. datetime.date(2015, 4, 7)
+            
+        Returns:
+            day_df (pandas Dataframe): empty if the market was not open on target_date
+        """
+        
+        pos = self._day_position(target_date)
+        if pos < 0:
+            return self.data.iloc[0:0]
+        
+        return self.data.iloc[self.day_starts[pos] : self.day_ends[pos]]
+    
+    
+    def add_additional_features(self, features=None, dtype=None):
+        """
+        Adds candle feature columns (ema50, center, head, tail, body, range & their % wrt ema50 / center)
+        to self.data. The FeatureEngine is kept in self.feature_engine, new candles can be
+        featurised from its state without recomputing the history (see models/features.py).
+        
+        Args:
+            features (list, optional): Subset of features.FEATURES. Defaults to None (all features).
+            dtype (np.dtype, optional): dtype of the feature columns, Eg. np.float32.
+                Defaults to None (np.float32 in compact mode, else np.float64).
+        """
+        
+        if dtype is None:
+            dtype = np.float32 if self.compact else np.float64
+        
+        self.feature_engine = FeatureEngine(features, dtype=dtype)
+        
+        with span('stock.features', rows=len(self.data)):
+            for name, values in self.feature_engine.compute(self.prices()).items():
+                self.data[name] = values
+        
+        self._buffer = None         # Columns were replaced, the next append_candles copies self.data again
+    
+    
+    def append_candles(self, candles):
+        """
+        Appends candles that come after the last candle of self.data, Eg. the bars of a live feed (see models/live.py)
+        
+        The rows are written into preallocated buffers that double in size when full (amortized O(new rows),
+        no pd.concat), self.data is rebuilt as a zero-copy view over them. The day table, the datetime index
+        and the incomplete days are extended for the new rows only. If add_additional_features was called,
+        the features of the new candles are computed from the carried state of self.feature_engine.
+        Incomplete days are not removed from appended candles, the session in progress is one.
+        
+        Args:
+            candles (pandas Dataframe or Dict): datetime indexed, or a 'date' entry, with 'open', 'high',
+                'low', 'close' & optionally 'volume' (else 0). Naive datetimes are exchange local time.
+                Other columns of self.data that are missing are computed (features) or filled with NaN / 0.
+                Columns assigned to self.data directly after the first append should be new columns,
+                replacing an existing one is not picked up by the next append.
+        
+        Returns:
+            first_row (int): Row position of the first appended candle in self.data
+        """
+        
+        if isinstance(candles, pd.DataFrame):
+            dates = candles.index
+            candles = {col: candles[col].to_numpy() for col in candles.columns}
+        else:
+            candles = dict(candles)
+            dates = candles.pop('date')
+        
+        dates = pd.DatetimeIndex(pd.to_datetime(np.atleast_1d(dates) if np.ndim(dates) == 0 else dates))
+        num_rows = len(dates)
+        
+        with span('stock.append', rows=num_rows):
+            
+            # Local (naive exchange time) & stored (UTC if tz aware) nanoseconds of the new candles
+            tz = self.data.index.tz
+            if dates.tz is not None:
+                dates = dates.tz_convert(tz) if tz is not None else dates.tz_localize(None)
+            elif tz is not None:
+                dates = dates.tz_localize(tz)
+            local = local_ns(dates)
+            stored = dates.as_unit('ns').asi8
+            
+            if np.any(np.diff(local) <= 0) or (len(self._index_ns) and num_rows and local[0] <= self._index_ns[-1]):
+                raise ValueError('Appended candles have to be in time order & after the last candle')
+            
+            if self._buffer is None or self.data.index is not self._buffer_index:
+                self._start_buffers()
+            self._sync_buffer()
+            
+            first_row = len(self._buffer)
+            
+            rows = {'_stored_ns': stored, '_local_ns': local}
+            for col in ('open', 'high', 'low', 'close'):
+                rows[col] = np.round(np.asarray(candles[col], dtype=np.float64), 2)
+            rows['volume'] = np.asarray(candles['volume']) if 'volume' in candles else np.zeros(num_rows, dtype=np.int64)
+            
+            if self.feature_engine is not None:
+                rows.update(self.feature_engine.update(rows))
+            
+            for col in self.data.columns:
+                if col in candles and col not in rows:
+                    rows[col] = np.asarray(candles[col])
+                elif col not in rows:
+                    kind = self.data[col].dtype.kind
+                    rows[col] = np.full(num_rows, np.nan if kind == 'f' else 0, dtype=self.data[col].dtype)
+            
+            self._buffer.append({col: rows[col] for col in self._buffer.columns})
+            self._extend_day_table(local, first_row)
+            self._refresh_views()
+            
+            self._resampled = {}
+            self.total_candles = len(self.data)
+            self.traded_days = len(self.day_keys)
+        
+        return first_row
+    
+    
+    def _start_buffers(self):
+        """
+        Moves self.data & the day table into growable buffers, once before the first append
+        """
+        
+        columns = {'_stored_ns': self.data.index.as_unit('ns').asi8, '_local_ns': self._index_ns}
+        columns.update({col: self.data[col].to_numpy() for col in self.data.columns})
+        self._buffer = ColumnBuffer(columns)
+        
+        self._day_buffer = ColumnBuffer({'day_keys': self.day_keys, 'day_starts': self.day_starts,
+                                         'day_ends': self.day_ends, 'day_counts': self.day_counts,
+                                         'day_is_full': self.day_is_full})
+        self._refresh_views()
+    
+    
+    def _sync_buffer(self):
+        """
+        Copies columns that were added to or replaced in self.data since the last append into the buffer
+        Only done when the columns changed, an existing column replaced by assignment is not looked for
+        (add_additional_features drops the buffers instead)
+        """
+        
+        if list(self.data.columns) == [col for col in self._buffer.columns if not col.startswith('_')]:
+            return
+        
+        for col in self.data.columns:
+            values = self.data[col].to_numpy()
+            if not self._buffer.owns(col, values):
+                self._buffer.add_column(col, values)
+        
+        for col in self._buffer.columns:
+            if not col.startswith('_') and col not in self.data.columns:
+                self._buffer.drop_column(col)
+    
+    
+    def _refresh_views(self):
+        """
+        Points self.data, self._index_ns & the day table at the filled rows of the buffers (no copy)
+        """
+        
+        views = self._buffer.views()
+        
+        # int64 UTC nanoseconds with a tz dtype, neither copied nor converted
+        tz = self.data.index.tz
+        if tz is not None:
+            index = pd.DatetimeIndex(views['_stored_ns'], dtype=pd.DatetimeTZDtype('ns', tz), copy=False, name=self.data.index.name)
+        else:
+            index = pd.DatetimeIndex(views['_stored_ns'].view('M8[ns]'), copy=False, name=self.data.index.name)
+        
+        columns = {col: values for col, values in views.items() if not col.startswith('_')}
+        self.data = pd.DataFrame(columns, index=index, copy=False)
+        self._buffer_index = self.data.index
+        self._index_ns = views['_local_ns']
+        
+        for name, values in self._day_buffer.views().items():
+            setattr(self, name, values)
+    
+    
+    def _extend_day_table(self, local, first_row):
+        """
+        Adds the candles at rows first_row onwards (local nanoseconds <local>) to the day table
+        """
+        
+        keys = local // NS_PER_DAY
+        starts = np.flatnonzero(np.diff(keys, prepend=keys[:1] - 1))
+        ends = np.append(starts[1:], len(keys))
+        keys, starts, ends = keys[starts], starts + first_row, ends + first_row
+        
+        num_days = len(self._day_buffer)
+        first_changed = num_days
+        
+        # The first new candles may continue the last day
+        if num_days and len(keys) and keys[0] == self._day_buffer['day_keys'][-1]:
+            self._day_buffer['day_ends'][-1] = ends[0]
+            self._day_buffer['day_counts'][-1] = ends[0] - self._day_buffer['day_starts'][-1]
+            keys, starts, ends = keys[1:], starts[1:], ends[1:]
+            first_changed -= 1
+        
+        self._day_buffer.append({'day_keys': keys, 'day_starts': starts, 'day_ends': ends,
+                                 'day_counts': ends - starts, 'day_is_full': np.zeros(len(keys), dtype=bool)})
+        
+        self._index_ns = self._buffer['_local_ns']
+        changed = slice(first_changed, None)
+        self._day_buffer['day_is_full'][changed] = self._full_days(self._day_buffer['day_starts'][changed],
+                                                                   self._day_buffer['day_ends'][changed])
+        
+        for name, values in self._day_buffer.views().items():
+            setattr(self, name, values)
+        
+        self._extend_day_lookup(num_days)
+        
+        # Incomplete days : only the changed days at the end of the list can differ
+        changed_keys = self.day_keys[changed]
+        if self.incomplete_day_dates is not None and len(changed_keys):
+            first_changed_date = datetime.date.fromordinal(EPOCH_ORDINAL + int(changed_keys[0]))
+            while self.incomplete_day_dates and self.incomplete_day_dates[-1] >= first_changed_date:
+                self.incomplete_day_dates.pop()
+            self.incomplete_day_dates.extend(datetime.date.fromordinal(EPOCH_ORDINAL + int(key))
+                                             for key in changed_keys[~self.day_is_full[changed]])
+    
+    
+    def resample(self, timeframe):
+        """
+        OHLCV bars of a larger timeframe, anchored at 9:15 & never crossing a session (see models/resample.py)
+        Bars are cached until self.data changes. A timeframe is built from the largest cached
+        timeframe that divides it, Eg. 30 mins from 15 mins bars, instead of from the base candles.
+        
+        Args:
+            timeframe (int or str): Bar size in minutes (a multiple of the candle duration), or 'day'
+                Eg. 3, 5, 15, 30, 60, 'day'
+        
+        Returns:
+            bars (pandas Dataframe): open, high, low, close, volume & candles (num of base candles in the bar)
+        """
+        
+        if timeframe in self._resampled:
+            return self._resampled[timeframe]
+        
+        if timeframe != 'day':
+            if not isinstance(timeframe, (int, np.integer)):
+                raise ValueError(f"timeframe has to be a num of minutes or 'day' (Eg. {TIMEFRAMES}), got {timeframe!r}")
+            if self.cdst_duration_days is not None or timeframe % self.cdst_duration_mins:
+                raise ValueError(f'Cannot build {timeframe} min bars from {self.cdst_duration_mins} min candles')
+        
+        # Largest cached timeframe the bars can be built from
+        source = self.data
+        divisors = [tf for tf in self._resampled if tf != 'day' and (timeframe == 'day' or timeframe % tf == 0)]
+        if divisors:
+            source = self._resampled[max(divisors)]
+        
+        self._resampled[timeframe] = resample_ohlcv(source, timeframe)
+        
+        return self._resampled[timeframe]
+    
+    
+    def prices(self, columns=('open', 'high', 'low', 'close')):
+        """
+        Price columns as float64 arrays, the precision computations should use
+        In compact mode the float32 prices are rounded back to the 2 decimal values they were read as,
+        so results are the same as without compact mode.
+        
+        Args:
+            columns (tuple, optional): Defaults to ('open', 'high', 'low', 'close').
+        
+        Returns:
+            prices (Dict): column -> float64 np.ndarray
+        """
+        
+        prices = {}
+        for col in columns:
+            values = self.data[col].to_numpy()
+            if values.dtype != np.float64:
+                values = np.round(values.astype(np.float64), 2)
+            prices[col] = values
+            
+        return prices
     
     
     # Function to extract indices for a single target date
     def get_indices(self, target_date):
-            
-        return self.data.index[self.data.index.date == target_date]
+        
+        pos = self._day_position(target_date)
+        if pos < 0:
+            return self.data.index[0:0]
+        
+        return self.data.index[self.day_starts[pos] : self.day_ends[pos]]
 
 
     # Function to chechk if a datetimeindex object is of 375 minutes
@@ -156,46 +565,133 @@ class Stock:
         return (con1 and con2)
         
     
+    def _local_ns(self):
+        """
+        Index as int64 nanoseconds of local (exchange) wall clock time, tz is dropped without shifting
+        """
+        
+        return local_ns(self.data.index)
+    
+    
+    def _day_bounds(self):
+        """
+        Run-length encodes the day component of the (sorted) index
+        
+        Returns:
+            day_keys (np.ndarray): int64 day number (days since 1970-01-01) of each trading day
+            starts (np.ndarray): row position of the first candle of each day
+            ends (np.ndarray): row position one past the last candle of each day
+        """
+        
+        day_keys = self._index_ns // NS_PER_DAY
+        
+        starts = np.flatnonzero(np.diff(day_keys, prepend=day_keys[:1] - 1))
+        ends = np.append(starts[1:], len(day_keys))
+        
+        return day_keys[starts], starts, ends
+    
+    
+    def _index_data(self):
+        """
+        Rebuilds the lookup structures over self.data, has to be called whenever its rows change
+        (appends through append_candles update them incrementally)
+        """
+        
+        self._index_ns = self._local_ns()
+        self._build_day_table()
+        self._resampled = {}
+        self._buffer = None
+        self._day_buffer = None
+        
+        
+    def _build_day_table(self):
+        """
+        Builds the day table, NumPy arrays with one entry per traded day, in one pass over the index
+        
+            day_keys    : int64 day number (days since 1970-01-01, exchange local date)
+            day_starts  : row position of the first candle of the day
+            day_ends    : row position one past the last candle of the day
+            day_counts  : number of candles in the day
+            day_is_full : True if the day traded for the full 6 hrs 15 mins
+            
+        A day is full if its first & last candle are 6 hrs 15 mins (minus one candle) apart
+        and it has self.cdst_per_day candles. Candles of a day or more always cover a full day.
+        """
+        
+        self.day_keys, self.day_starts, self.day_ends = self._day_bounds()
+        self.day_counts = self.day_ends - self.day_starts
+        self.day_is_full = self._full_days(self.day_starts, self.day_ends)
+        
+        # Dense day key -> position table, a date lookup is a single array access
+        self._day_lookup = np.full(0, -1, dtype=np.int32)
+        self._extend_day_lookup(0)
+    
+    
+    def _full_days(self, starts, ends):
+        """
+        day_is_full of the days spanning rows [starts[i], ends[i])
+        """
+        
+        if self.cdst_duration_days is not None:
+            return np.ones(len(starts), dtype=bool)
+        
+        day_span_ns = self._index_ns[ends - 1] - self._index_ns[starts]
+        full_span_ns = (375*60 - self.cdst_duration_secs) * NS_PER_SEC
+        
+        return (day_span_ns == full_span_ns) & ((ends - starts) == self.cdst_per_day)
+    
+    
+    def _extend_day_lookup(self, first_new_day):
+        """
+        Adds the days of the day table from position <first_new_day> on to self._day_lookup
+        """
+        
+        if first_new_day >= len(self.day_keys):
+            return
+        
+        size = int(self.day_keys[-1] - self.day_keys[0] + 1)
+        if size > len(self._day_lookup):
+            self._day_lookup = np.concatenate([self._day_lookup, np.full(size - len(self._day_lookup), -1, dtype=np.int32)])
+        
+        new_keys = self.day_keys[first_new_day:]
+        self._day_lookup[new_keys - self.day_keys[0]] = np.arange(first_new_day, len(self.day_keys), dtype=np.int32)
+    
+    
+    def _day_position(self, target_date):
+        """
+        Position of target_date in the day table, -1 if the market was not open on that day
+        """
+        
+        if not len(self.day_keys):
+            return -1
+        
+        offset = target_date.toordinal() - EPOCH_ORDINAL - int(self.day_keys[0])
+        if offset < 0 or offset >= len(self._day_lookup):
+            return -1
+        
+        return int(self._day_lookup[offset])
+    
+    
     def _get_incomplete_days(self, verbose=False):
         """
         Analyses which days traded for less than 6 hrs 15 mins
         Sets a list of incomplete days (trading time != 6hrs 15mins) for the stock
+        Read off the day table, see _build_day_table for what counts as a full day
         
         Args:
             verbose (bool, optional): Display the incomplete day dates. Defaults to False.
     
         """
         
-        dates_present = list(self.data.index.date)                  # All dates whose data is available
-        dates_present = list(OrderedDict.fromkeys(dates_present))   # Unique dates
-
-        # Create a pool of processes
-        pool = Pool(processes=50)
-        # Apply the function to each target date in parallel
-        matched_indices = pool.map(self.get_indices, dates_present)
-        # Close the pool
-        pool.close()
-        pool.join()
-
-        # Create a pool of processes
-        pool = Pool(processes=50)
-        # Apply the function to each target date in parallel
-        fullornot = pool.map(self.is_375mins, matched_indices)
-        fullornot = np.array(fullornot)
-        # Close the pool
-        pool.close()
-        pool.join()
-
         # Filter incomplete day dates
-        incomplete_day_dates  = (np.array(dates_present)[~fullornot]).tolist()
+        incomplete_day_dates = [datetime.date.fromordinal(EPOCH_ORDINAL + int(key)) for key in self.day_keys[~self.day_is_full]]
         
         if verbose:
             print(incomplete_day_dates)
-            
-        print(f"\n{len(incomplete_day_dates)}/{self.traded_days} Incomplete days ")
+            print(f"\n{len(incomplete_day_dates)}/{self.traded_days} Incomplete days ")
 
         # Set the attribute self.incomplete_day_dates to the calculated list
-        self.incomplete_day_dates = incomplete_day_dates.copy()
+        self.incomplete_day_dates = incomplete_day_dates
     
       
     def get_datetime_idx(self, target_datetime = None):
@@ -207,21 +703,66 @@ class Stock:
                 Eg. target_datetime  = pd.Timestamp(2015, 2, 25, 11, 39)
 
         Returns:
-            matched_idx (int)
+            matched_idx (np.ndarray): [row position] if there is a candle at target_datetime, else empty
         """
         
-        # If only date is given, It makes the 9:15 as hour:min as default
-        if target_datetime.hour==0:
-            target_datetime = pd.Timestamp(year=target_datetime.year, month=target_datetime.month, 
-                                           day=target_datetime.day, hour=9, minute=15)
-
-        matched_arr =  (self.data.index.tz_localize(None) == target_datetime)
-        matched_idx =   np.where(matched_arr)[0]
-        # matched_idx =    matched_idx.flatten().tolist()[0]
+        target_ns = self._to_index_ns(target_datetime)
+        matched_idx = self._searchsorted_previous(target_ns)
+        
+        # Keep only an exact match
+        matched_idx = matched_idx[(matched_idx >= 0) & (self._index_ns[matched_idx] == target_ns)]
         
         return matched_idx
     
     
+    def get_datetime_positions(self, target_datetimes):
+        """
+        Row positions in self.data for one or many datetimes, by binary search over the cached index
+        Each datetime resolves to the candle at that time, or if there is none the nearest previous candle
+        
+        Args:
+            target_datetimes (pd.Timestamp or array-like of datetimes): naive datetimes are exchange local time
+                Eg. target_datetimes = pd.date_range('2015-02-25 09:15', periods=100_000, freq='min')
+
+        Returns:
+            positions (int or np.ndarray): -1 where a datetime is before the first candle
+        """
+        
+        scalar = np.ndim(target_datetimes) == 0
+        
+        positions = self._searchsorted_previous(self._to_index_ns(target_datetimes))
+        
+        return int(positions[0]) if scalar else positions
+    
+    
+    def _searchsorted_previous(self, target_ns):
+        
+        return np.searchsorted(self._index_ns, target_ns, side='right') - 1
+    
+    
+    def _to_index_ns(self, target_datetimes):
+        """
+        Converts datetimes to the int64 representation of self._index_ns (always returns an array)
+        """
+        
+        if np.ndim(target_datetimes) == 0:
+            target_datetimes = [target_datetimes]
+        
+        targets = pd.DatetimeIndex(pd.to_datetime(target_datetimes))
+        
+        # Aware datetimes are moved to the exchange timezone, naive ones are taken as they are
+        if targets.tz is not None:
+            targets = targets.tz_convert(self.data.index.tz).tz_localize(None)
+        
+        targets_ns = targets.as_unit('ns').asi8
+        
+        # If only date is given, It makes the 9:15 as hour:min as default (intraday candles only)
+        if self.cdst_duration_days is None:
+            targets_ns = np.where(targets_ns % NS_PER_DAY == 0, targets_ns + SESSION_OPEN_NS, targets_ns)
+            
+        return targets_ns
+    
+    
     def _setup_durations(self):
     
         timedelta = self.data.index[1] - self.data.index[0]
@@ -242,15 +783,12 @@ class Stock:
         """
         Sets the [self.symbol] and [self.company_name] attributes
         """
-                
-        # All traded securities symbols
-        all_symbols = list(self.symbol2name.keys())
         
-        for symbol in all_symbols:    
-            if symbol.lower() in self.csv_path.lower():
-                
-                self.symbol = symbol
-                self.company_name = self.symbol2name[symbol]
+        registry = get_symbol_registry(self.EQUITY_L_PATH)
+        
+        self.symbol = registry.resolve(self.csv_path)
+        if self.symbol is not None:
+            self.company_name = registry.symbol2name[self.symbol]
                 
                 
     def _remove_incomplete_days(self):
@@ -258,11 +796,15 @@ class Stock:
         Removes the incomplete days fron self.data attribute (it's a dataframe)
         """
     
-        bad_dates = self.incomplete_day_dates
-        filtered_indices = ~np.isin(self.data.index.date, bad_dates)
+        if not self.incomplete_day_dates:
+            return
+        
+        # Row mask straight from the day table
+        filtered_indices = np.repeat(self.day_is_full, self.day_counts)
         
         filtered_df = self.data[filtered_indices]
         
         self.data = filtered_df.copy()
+        self._index_data()
         self.total_candles = len(self.data)                 # Num of Candlesticks in the dataset updated
-        self.traded_days = len(set(self.data.index.date))   # Num days market was open updated
\ No newline at end of file
+        self.traded_days = len(self.day_keys)               # Num days market was open updated
@@ -0,0 +1,130 @@
+import numpy as np
+
+from features import FeatureEngine
+
+
+DIRECTIONS = ['down', 'flat', 'up']
+
+
+class CandleTokenizer:
+    """
+    Quantizes candles into integer token ids, whole arrays at a time
+
+    A candle's token combines its direction (down / flat / up) with the bins its body, head (upper wick)
+    and tail (lower wick) fall in, all measured in % of the reference price ('center' or 'ema50'),
+    i.e. the body_per_wrt_<reference> etc. features of Stock.add_additional_features.
+
+        token_id = ((direction * num_body_bins + body_bin) * num_wick_bins + head_bin) * num_wick_bins + tail_bin
+
+    With no bins at all the vocabulary is the 3 words 'down', 'flat', 'up'.
+
+        tokenizer = CandleTokenizer(body_bins=(0.02, 0.05, 0.1), wick_bins=(0.02, 0.05))
+        token_ids = tokenizer.encode(stock.data)        # np.int16 array, one id per candle
+        words = tokenizer.token_names[token_ids]        # 'up_b2_h1_t0', ...
+    """
+
+    def __init__(self, body_bins=(0.01, 0.03, 0.06, 0.1, 0.2), wick_bins=(0.01, 0.03, 0.06, 0.1), reference='center'):
+        """
+        Args:
+            body_bins (tuple, optional): Increasing bin edges (in %) for the body. Defaults to (0.01, 0.03, 0.06, 0.1, 0.2).
+            wick_bins (tuple, optional): Increasing bin edges (in %) for head & tail. Defaults to (0.01, 0.03, 0.06, 0.1).
+            reference (str, optional): 'center' or 'ema50'. Defaults to 'center'.
+        """
+
+        if reference not in ('center', 'ema50'):
+            raise ValueError(f"reference has to be 'center' or 'ema50', got {reference!r}")
+
+        self.body_bins = np.asarray(body_bins, dtype=np.float64)
+        self.wick_bins = np.asarray(wick_bins, dtype=np.float64)
+        self.reference = reference
+
+        for bins in (self.body_bins, self.wick_bins):
+            if np.any(np.diff(bins) <= 0):
+                raise ValueError(f'Bin edges have to be strictly increasing, got {bins.tolist()}')
+
+        self.num_body_bins = len(self.body_bins) + 1
+        self.num_wick_bins = len(self.wick_bins) + 1
+        self.vocab_size = len(DIRECTIONS) * self.num_body_bins * self.num_wick_bins**2
+
+        # Smallest integer type that holds every id
+        self.dtype = np.dtype(np.int16) if self.vocab_size <= np.iinfo(np.int16).max else np.dtype(np.int32)
+
+        self.token_names = self._build_token_names()     # np.ndarray of str, token_id -> word
+
+
+    @property
+    def feature_names(self):
+        """
+        Names of the (body, head, tail) % features the tokenizer reads
+        """
+
+        return [f'{part}_per_wrt_{self.reference}' for part in ('body', 'head', 'tail')]
+
+
+    def encode(self, ohlc):
+        """
+        Token ids of every candle
+
+        Args:
+            ohlc (pandas Dataframe or Dict): has 'open' & 'close' columns, and either the % features
+                                             (see feature_names) or 'high' & 'low' to compute them
+
+        Returns:
+            token_ids (np.ndarray): int16 (int32 for large vocabularies), one id per candle
+        """
+
+        if all(name in ohlc for name in self.feature_names):
+            body, head, tail = (np.asarray(ohlc[name]) for name in self.feature_names)
+        else:
+            values = FeatureEngine(self.feature_names).compute(ohlc)
+            body, head, tail = (values[name] for name in self.feature_names)
+
+        direction = np.sign(np.asarray(ohlc['close']) - np.asarray(ohlc['open'])).astype(np.int32) + 1
+
+        return self.encode_features(direction, body, head, tail)
+
+
+    def encode_features(self, direction, body, head, tail):
+        """
+        Token ids from already computed features
+
+        Args:
+            direction (np.ndarray): 0 down, 1 flat, 2 up
+            body, head, tail (np.ndarray): % wrt the reference price
+
+        Returns:
+            token_ids (np.ndarray)
+        """
+
+        token_ids = np.asarray(direction, dtype=np.int32) * self.num_body_bins + np.digitize(body, self.body_bins)
+        token_ids = token_ids * self.num_wick_bins + np.digitize(head, self.wick_bins)
+        token_ids = token_ids * self.num_wick_bins + np.digitize(tail, self.wick_bins)
+
+        return token_ids.astype(self.dtype)
+
+
+    def decode(self, token_ids):
+        """
+        Words of token ids, Eg. [407, 12] -> ['up_b4_h1_t2', 'down_b0_h2_t2']
+        """
+
+        return self.token_names[np.asarray(token_ids)]
+
+
+    def _build_token_names(self):
+
+        names = []
+        for direction in DIRECTIONS:
+            for b in range(self.num_body_bins):
+                for h in range(self.num_wick_bins):
+                    for t in range(self.num_wick_bins):
+
+                        parts = [direction]
+                        if len(self.body_bins):
+                            parts.append(f'b{b}')
+                        if len(self.wick_bins):
+                            parts += [f'h{h}', f't{t}']
+
+                        names.append('_'.join(parts))
+
+        return np.array(names)
@@ -0,0 +1,277 @@
+import contextlib
+import datetime
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from gensim.models import Word2Vec
+from gensim.models.callbacks import CallbackAny2Vec
+
+from corpus import WindowCorpus, write_corpus_file
+from instrument import span
+
+
+class EpochTimer(CallbackAny2Vec):
+    """
+    gensim callback, records the wall time & throughput of every training epoch
+    """
+
+    def __init__(self, words_per_epoch, verbose=True):
+
+        self.words_per_epoch = words_per_epoch
+        self.verbose = verbose
+
+        self.epoch = 0
+        self.stats = []             # One dict per epoch : epoch, wall_secs, words_per_sec
+        self._epoch_start = None
+
+
+    def on_epoch_begin(self, model):
+
+        self._epoch_start = time.perf_counter()
+
+
+    def on_epoch_end(self, model):
+
+        wall_secs = time.perf_counter() - self._epoch_start
+        words_per_sec = self.words_per_epoch / wall_secs if wall_secs > 0 else float('inf')
+
+        self.stats.append({'epoch': self.epoch, 'wall_secs': wall_secs, 'words_per_sec': words_per_sec})
+
+        if self.verbose:
+            print(f'EPOCH {self.epoch} : {wall_secs:.2f} secs, {words_per_sec:,.0f} words/sec')
+
+        self.epoch += 1
+
+
+def train_word2vec(sentences, corpus_path=None, workers=None, verbose=True, **word2vec_kwargs):
+    """
+    Trains Word2Vec through gensim's corpus_file mode, which runs one reader per worker thread
+    outside the GIL and scales with the num of cores, unlike training from a Python iterable.
+
+    The sentences are first streamed to a whitespace delimited corpus file (chunk by chunk, the
+    corpus is never held in memory as lists of words).
+
+        model, epoch_stats = train_word2vec(WindowCorpus.from_stock(stock, tokenizer),
+                                            vector_size=50, window=5, min_count=1, sg=1)
+
+    Args:
+        sentences (WindowCorpus or iterable of lists of words): Training corpus, None to train on
+                                                                 an existing corpus file at corpus_path
+                                                                 (Eg. written by MarketCorpus.write)
+        corpus_path (str, optional): Where to write the corpus file, it is kept if given.
+                                     Defaults to None (temporary file, deleted after training).
+        workers (int, optional): Num of worker threads. Defaults to None (all cores).
+        verbose (bool, optional): Print wall time & words/sec of every epoch. Defaults to True.
+        **word2vec_kwargs: Passed on to gensim.models.Word2Vec (vector_size, window, sg, epochs, ...)
+
+    Returns:
+        model (gensim.models.Word2Vec)
+        epoch_stats (list): One dict per epoch with keys epoch, wall_secs, words_per_sec
+    """
+
+    workers = workers or os.cpu_count()
+
+    with _corpus_file(sentences, corpus_path, verbose) as (corpus_path, num_words):
+
+        if not num_words:
+            raise ValueError('Cannot train on an empty corpus, no window fits in the data')
+
+        timer = EpochTimer(num_words, verbose=verbose)
+
+        with span('training.word2vec') as train_span:
+            model = Word2Vec(corpus_file=corpus_path, workers=workers,
+                             callbacks=[timer] + list(word2vec_kwargs.pop('callbacks', [])), **word2vec_kwargs)
+            train_span.rows = num_words * model.epochs
+
+    return model, timer.stats
+
+
+def update_word2vec(model_path, corpus, replay_fraction=0.0, epochs=None, seed=0, corpus_path=None,
+                    workers=None, verbose=True, save=True):
+    """
+    Continues training a saved model on the windows added since its last checkpoint, instead of
+    retraining on the whole history
+
+    The windows whose last candle is after the data range of the checkpoint (see save_checkpoint) are
+    new. Tokens that are new to the model are added to its vocabulary (build_vocab(update=True)), then
+    the model is trained on the new windows plus, optionally, a random replay sample of the windows it
+    was trained on before, which keeps the vectors of rare old tokens from drifting away.
+
+        corpus = WindowCorpus.from_stock(Stock('RELIANCE_minute.csv'), tokenizer)
+        model, epoch_stats = update_word2vec('word2vec_ohlc.model', corpus, replay_fraction=0.1)
+
+    Args:
+        model_path (str): Model saved with save_checkpoint
+        corpus (WindowCorpus): Windows of the full history, with candle times (WindowCorpus.from_stock)
+        replay_fraction (float, optional): Replayed old windows per new window. Defaults to 0.0.
+        epochs (int, optional): Defaults to None (the epochs of the model).
+        seed (int, optional): Seed of the replay sample. Defaults to 0.
+        corpus_path (str, optional): Where to write the corpus file, it is kept if given. Defaults to None.
+        workers (int, optional): Num of worker threads. Defaults to None (all cores).
+        verbose (bool, optional): Print wall time & words/sec of every epoch. Defaults to True.
+        save (bool, optional): Save the model & its checkpoint metadata to model_path. Defaults to True.
+
+    Returns:
+        model (gensim.models.Word2Vec)
+        epoch_stats (list): One dict per epoch, empty if there were no new windows
+    """
+
+    meta = load_checkpoint_meta(model_path)
+    if meta is None:
+        raise FileNotFoundError(f'No checkpoint metadata for {model_path}, train it with train_word2vec & save_checkpoint first')
+
+    model = Word2Vec.load(model_path)
+    workers = workers or os.cpu_count()
+    epochs = epochs or model.epochs
+
+    new_windows = corpus.since(meta['last_ns'])
+
+    if not len(new_windows):
+        if verbose:
+            print(f"NO NEW WINDOWS SINCE {meta['last_datetime']}")
+        return model, []
+
+    # Windows are in time order, the new ones are the last len(new_windows)
+    num_old = len(corpus) - len(new_windows)
+    num_replay = min(int(round(replay_fraction * len(new_windows))), num_old)
+    replay_windows = np.sort(np.random.default_rng(seed).choice(num_old, num_replay, replace=False))
+
+    sentences = corpus.subset(np.concatenate([replay_windows, np.arange(num_old, len(corpus))]))
+
+    with _corpus_file(sentences, corpus_path, verbose) as (corpus_path, num_words):
+
+        timer = EpochTimer(num_words, verbose=verbose)
+
+        with span('training.update_word2vec', rows=num_words * epochs):
+            model.build_vocab(corpus_file=corpus_path, update=True)
+            model.train(corpus_file=corpus_path, total_examples=len(sentences), total_words=num_words,
+                        epochs=epochs, callbacks=[timer])
+
+    if save:
+        save_checkpoint(model, model_path, corpus, mode='incremental', new_windows=len(new_windows),
+                        replay_windows=num_replay, epochs=epochs, train_secs=sum(stat['wall_secs'] for stat in timer.stats))
+
+    return model, timer.stats
+
+
+def checkpoint_meta_path(model_path):
+    """
+    Path of the metadata sidecar of a saved model, '<model_path>.meta.json'
+    """
+
+    return os.fspath(model_path) + '.meta.json'
+
+
+def load_checkpoint_meta(model_path):
+    """
+    Checkpoint metadata of a saved model (see save_checkpoint), None if it has none
+    """
+
+    try:
+        with open(checkpoint_meta_path(model_path)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(model, model_path, corpus, mode='full', **run_info):
+    """
+    Saves the model & a metadata sidecar recording the data range it has been trained up to
+
+    The sidecar holds the first & last candle time the model covers, its vocabulary size & a history
+    with one entry per training run, update_word2vec trains on the windows after last_ns only.
+
+    Args:
+        model (gensim.models.Word2Vec)
+        model_path (str): Where to save the model
+        corpus (WindowCorpus): Corpus the model has now been trained up to the end of, with candle times
+        mode (str, optional): 'full' for a model trained from scratch on <corpus>, the sidecar is rebuilt from it,
+                              'incremental' for an update, the run is added to the existing sidecar. Defaults to 'full'.
+        **run_info: Recorded in the history entry of this run, Eg. new_windows=..., epochs=...
+    """
+
+    end_ns = corpus.window_end_ns()
+    if not len(end_ns):
+        raise ValueError('Cannot checkpoint a model on an empty corpus')
+
+    if mode not in ('full', 'incremental'):
+        raise ValueError(f"mode has to be 'full' or 'incremental', got {mode!r}")
+
+    meta = load_checkpoint_meta(model_path) if mode == 'incremental' else None
+    if meta is None:
+        meta = {'first_ns': int(corpus.candle_ns[corpus.starts[0]]), 'history': []}
+
+    last_ns = int(end_ns.max())
+    run = {'trained_at'    : datetime.datetime.now().isoformat(timespec='seconds'),
+           'mode'          : mode,
+           'from_datetime' : meta.get('last_datetime') or _ns_to_iso(meta['first_ns']),
+           'to_datetime'   : _ns_to_iso(last_ns),
+           }
+    run.update(run_info)
+
+    meta.update({'first_datetime' : _ns_to_iso(meta['first_ns']),
+                 'last_ns'        : last_ns,
+                 'last_datetime'  : _ns_to_iso(last_ns),
+                 'vocab_size'     : len(model.wv),
+                 })
+    meta['history'].append(run)
+
+    model.save(model_path)
+
+    with open(checkpoint_meta_path(model_path), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+
+def _ns_to_iso(local_ns):
+
+    return pd.Timestamp(local_ns).isoformat()
+
+
+@contextlib.contextmanager
+def _corpus_file(sentences, corpus_path, verbose):
+    """
+    Writes the sentences to a corpus file, a temporary one (deleted on exit) if corpus_path is None
+    With sentences None, corpus_path is an already written corpus file & its words are counted
+
+    Yields:
+        (corpus_path, num_words)
+    """
+
+    if sentences is None:
+        if corpus_path is None:
+            raise ValueError('Either sentences or the path of a written corpus file is needed')
+
+        with open(corpus_path) as f:
+            num_words = sum(len(line.split()) for line in f)
+
+        yield corpus_path, num_words
+        return
+
+    keep_corpus = corpus_path is not None
+    if not keep_corpus:
+        fd, corpus_path = tempfile.mkstemp(prefix='candle2vec-', suffix='.txt')
+        os.close(fd)
+
+    try:
+        start = time.perf_counter()
+
+        with span('training.write_corpus') as write_span:
+            if isinstance(sentences, WindowCorpus):
+                num_words = sentences.write_corpus_file(corpus_path)
+            else:
+                num_words = write_corpus_file(sentences, corpus_path)
+            write_span.rows = num_words
+
+        if verbose:
+            print(f'CORPUS FILE : {num_words:,} words written in {time.perf_counter() - start:.2f} secs')
+
+        yield corpus_path, num_words
+
+    finally:
+        if not keep_corpus:
+            os.remove(corpus_path)
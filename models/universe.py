@@ -0,0 +1,176 @@
+import glob
+import os
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+
+from cache import arrays_from_frame, frame_from_arrays, index_from_ns, is_cache_fresh, load_cache_arrays
+from stock import Stock, get_symbol_registry
+
+
+def _ingest(csv_path):
+    """
+    Worker : parses <csv_path> into its binary cache (a no-op if the cache is fresh)
+    Only the path, row count & whether the cache could be written travel back to the parent,
+    the data is shared through the memory mapped cache
+    """
+
+    df = Stock.read_df(csv_path, use_cache=True)
+
+    return csv_path, len(df), is_cache_fresh(csv_path)
+
+
+def symbol_from_path(csv_path):
+    """
+    NSE symbol of a csv file if it resolves to one, else the file name up to the first '_'
+    Eg. './data/NIFTY50_day.csv' -> 'NIFTY50'
+    """
+
+    symbol = get_symbol_registry(Stock.EQUITY_L_PATH).resolve(csv_path)
+    if symbol is None:
+        symbol = os.path.splitext(os.path.basename(csv_path))[0].split('_')[0].upper()
+
+    return symbol
+
+
+class Universe:
+    """
+    All the csv files of a directory, Eg. data/NIFTY50_day.csv, data/NIFTYMIDCAPSELECT_day.csv
+
+    Files are parsed across a process pool into the binary cache next to each csv (see models/cache.py).
+    Workers return no data, the parent memory maps the cached arrays, so every symbol's data is shared
+    with the page cache instead of being pickled between processes. A csv whose cache cannot be written
+    (Eg. a read-only data directory) is parsed again in the parent & held in memory instead.
+
+        universe = Universe('./data', pattern='*_day.csv')
+        closes = universe.panel('close')        # timestamps x symbols, NaN where a symbol has no candle
+    """
+
+    def __init__(self, directory, pattern='*.csv', processes=None, chunksize=4):
+        """
+        Args:
+            directory (str): Directory with the csv files
+            pattern (str, optional): glob pattern of the files to load. Defaults to '*.csv'.
+            processes (int, optional): Size of the process pool, 1 loads in this process.
+                                       Defaults to None (num of cores).
+            chunksize (int, optional): Num of files handed to a worker at a time. Defaults to 4.
+        """
+
+        self.directory = directory
+        self.csv_paths = sorted(glob.glob(os.path.join(directory, pattern)))
+
+        self.symbols = []           # Symbols in the order of self.csv_paths
+        self.csv_path = {}          # symbol -> csv path
+        self.arrays = {}            # symbol -> Dict of memory mapped columns ('date' is int64 epoch ns, UTC)
+        self.meta = {}              # symbol -> cache metadata
+        self.cached = {}            # symbol -> True if its arrays are memory mapped from the cache, False if held in memory
+
+        self._load(processes, chunksize)
+
+        self.timestamps = self._union_timestamps()      # Sorted int64 epoch ns of every candle of any symbol
+        self._positions = {}                            # symbol -> rows of self.timestamps it has candles at
+
+
+    def _load(self, processes, chunksize):
+
+        if processes == 1 or len(self.csv_paths) <= 1:
+            results = [_ingest(path) for path in self.csv_paths]
+        else:
+            with Pool(processes=processes) as pool:
+                results = list(pool.imap_unordered(_ingest, self.csv_paths, chunksize=chunksize))
+
+        cached = {path: fresh for path, _, fresh in results}
+
+        for path in self.csv_paths:
+            symbol = symbol_from_path(path)
+            if symbol in self.csv_path:
+                raise ValueError(f'{path} and {self.csv_path[symbol]} are both {symbol}')
+
+            self.symbols.append(symbol)
+            self.csv_path[symbol] = path
+            self.cached[symbol] = cached[path]
+
+            if cached[path]:
+                self.arrays[symbol], self.meta[symbol] = load_cache_arrays(path)
+            else:
+                # No cache, Eg. a read-only data directory : the csv is parsed again, here
+                self.arrays[symbol], self.meta[symbol] = arrays_from_frame(Stock.read_df(path, use_cache=False))
+
+
+    def _union_timestamps(self):
+
+        if not self.symbols:
+            return np.empty(0, dtype=np.int64)
+
+        return np.unique(np.concatenate([self.arrays[symbol]['date'] for symbol in self.symbols]))
+
+
+    def __len__(self):
+
+        return len(self.symbols)
+
+
+    def __contains__(self, symbol):
+
+        return symbol in self.arrays
+
+
+    def positions(self, symbol):
+        """
+        Rows of self.timestamps at which <symbol> has candles, in the order of its own data
+        """
+
+        if symbol not in self._positions:
+            self._positions[symbol] = np.searchsorted(self.timestamps, self.arrays[symbol]['date'])
+
+        return self._positions[symbol]
+
+
+    def index(self):
+        """
+        self.timestamps as a DatetimeIndex, in the timezone of the first symbol
+        """
+
+        if not self.symbols:
+            return index_from_ns(self.timestamps, {'tz': None})
+
+        return index_from_ns(self.timestamps, self.meta[self.symbols[0]])
+
+
+    def frame(self, symbol):
+        """
+        OHLCV dataframe of one symbol, a zero-copy view on its cache (same as Stock.read_df)
+        """
+
+        return frame_from_arrays(self.arrays[symbol], self.meta[symbol])
+
+
+    def stock(self, symbol, **kwargs):
+        """
+        Stock object of one symbol, kwargs are passed on to Stock
+        """
+
+        return Stock(self.csv_path[symbol], **kwargs)
+
+
+    def panel(self, field='close', symbols=None, dtype=np.float64):
+        """
+        One field of every symbol aligned on the union of timestamps
+
+        Args:
+            field (str, optional): Column, Eg. 'open', 'close', 'volume'. Defaults to 'close'.
+            symbols (list, optional): Subset of symbols. Defaults to None (all).
+            dtype (np.dtype, optional): dtype of the panel. Defaults to np.float64.
+
+        Returns:
+            panel (pandas Dataframe): timestamps x symbols, NaN where a symbol has no candle
+        """
+
+        symbols = self.symbols if symbols is None else list(symbols)
+
+        values = np.full((len(self.timestamps), len(symbols)), np.nan, dtype=dtype)
+        for col, symbol in enumerate(symbols):
+            values[self.positions(symbol), col] = self.arrays[symbol][field]
+
+        return pd.DataFrame(values, index=self.index(), columns=symbols)
@@ -1,6 +1,10 @@
+import numpy as np
 import pandas as pd
 
 
+MERGE_POLICIES = ('first', 'last', 'non_null')
+
+
 def join_dataframes(df1, df2):
     """
     Joins two dataframe to return the combined dataframe
@@ -14,18 +18,172 @@ def join_dataframes(df1, df2):
         df3 (pandas dataframe): OHLC dataframe, datetime indexed
                                 df3 contains the data of both frames
     """
-    
+
     # Sort according to datetime index
-    df1 =  df1.sort_index()
-    df2 =  df2.sort_index()
-    
-    # Create a new dataframe df3 with all indexes
-    df3 = pd.concat([df1, df2]).groupby(level=0).first()
-
-    # Fill missing values with values from the other dataframe
-    df3 = df3.combine_first(df1).combine_first(df2)
-    
-    # Sort the new dataset
-    df3 =  df3.sort_index()
-    
-    return df3
\ No newline at end of file
+    if not df1.index.is_monotonic_increasing:
+        df1 =  df1.sort_index()
+    if not df2.index.is_monotonic_increasing:
+        df2 =  df2.sort_index()
+
+    # Union of both, where a timestamp is in both the non null value of df1 comes first
+    df3 = merge_sorted([df1, df2], policy='non_null')
+
+    return df3
+
+
+def merge_sorted(sources, policy='first', chunk_rows=1_000_000):
+    """
+    Merges any number of datetime indexed OHLCV dataframes that are each sorted by time
+    into their sorted union, in a single pass over the sources
+
+    The sources are walked in time order, chunk_rows timestamps at a time, so apart from the output
+    only a chunk of every source is in memory (memory mapped sources, Eg. Stock.read_df on a cached
+    csv, are paged in a chunk at a time).
+
+    A timestamp present in more than one source is resolved by <policy> :
+        'first'    : the row of the earliest source in <sources> wins
+        'last'     : the row of the latest source wins, Eg. [master, delta1, delta2, ...] lets
+                     daily increments overwrite the master series
+        'non_null' : per column, the first non null value in source order wins
+
+    Args:
+        sources (list): pandas Dataframes, datetime indexed, each sorted by its index
+        policy (str, optional): One of MERGE_POLICIES. Defaults to 'first'.
+        chunk_rows (int, optional): Timestamps per merge step. Defaults to 1_000_000.
+
+    Returns:
+        merged (pandas Dataframe): Union of the columns of every source, in order of first appearance
+    """
+
+    if policy not in MERGE_POLICIES:
+        raise ValueError(f'policy has to be one of {MERGE_POLICIES}, got {policy!r}')
+
+    sources = [df for df in sources if len(df)]
+    if not sources:
+        return pd.DataFrame()
+
+    columns = list(dict.fromkeys(col for df in sources for col in df.columns))
+    tz = sources[0].index.tz
+
+    keys, values = [], []
+    for df in sources:
+        index = df.index if df.index.tz is None or tz is None else df.index.tz_convert(tz)
+        index = index.as_unit('ns').asi8
+        if np.any(index[1:] < index[:-1]):
+            raise ValueError('merge_sorted needs every source sorted by its index')
+        keys.append(index)
+        values.append({col: df[col].to_numpy() for col in df.columns})
+
+    out_keys, out_values = [], {col: [] for col in columns}
+    cursors = [0] * len(sources)
+
+    while True:
+        pending = [s for s in range(len(sources)) if cursors[s] < len(keys[s])]
+        if not pending:
+            break
+
+        # Upper bound of this step : the smallest of each source's chunk_rows-th next timestamp
+        bound = min(keys[s][min(cursors[s] + chunk_rows, len(keys[s])) - 1] for s in pending)
+
+        # Slice of every source up to (and including) the bound
+        slices = []
+        for s in pending:
+            stop = int(np.searchsorted(keys[s], bound, side='right'))
+            slices.append((s, cursors[s], stop))
+            cursors[s] = stop
+
+        chunk_keys = np.concatenate([keys[s][start:stop] for s, start, stop in slices])
+        chunk_source = np.concatenate([np.full(stop - start, s) for s, start, stop in slices])
+
+        # Stable sort on (timestamp, source) : duplicates end up next to each other in source order
+        order = np.lexsort((chunk_source, chunk_keys))
+        chunk_keys = chunk_keys[order]
+
+        is_first = np.r_[True, chunk_keys[1:] != chunk_keys[:-1]]
+        first_rows = np.flatnonzero(is_first)
+        last_rows = np.r_[first_rows[1:] - 1, len(chunk_keys) - 1]
+
+        for col in columns:
+            col_values = np.concatenate([_column_slice(values[s], col, start, stop) for s, start, stop in slices])[order]
+
+            if policy == 'first':
+                winner = first_rows
+            elif policy == 'last':
+                winner = last_rows
+            else:
+                # First non null entry of every timestamp, the first entry if all are null
+                group = np.cumsum(is_first) - 1
+                valid_rows = np.flatnonzero(~pd.isna(col_values))
+                valid_group = group[valid_rows]
+                first_valid = np.r_[True, valid_group[1:] != valid_group[:-1]] if len(valid_rows) else np.empty(0, dtype=bool)
+
+                winner = first_rows.copy()
+                winner[valid_group[first_valid]] = valid_rows[first_valid]
+
+            out_values[col].append(col_values[winner])
+
+        out_keys.append(chunk_keys[first_rows])
+
+    index = pd.DatetimeIndex(np.concatenate(out_keys).view('M8[ns]'), name=sources[0].index.name)
+    if tz is not None:
+        index = index.tz_localize('UTC').tz_convert(tz)
+
+    return pd.DataFrame({col: np.concatenate(out_values[col]) for col in columns}, index=index)
+
+
+def _column_slice(source_values, col, start, stop):
+    """
+    Rows [start, stop) of one column of a source, NaN if the source does not have the column
+    """
+
+    if col in source_values:
+        return source_values[col][start:stop]
+
+    return np.full(stop - start, np.nan)
+
+
+def compact_ohlcv(df, price_columns=('open', 'high', 'low', 'close'), decimals=2):
+    """
+    Returns the dataframe with smaller dtypes, at no loss at <decimals> precision
+        prices : float32, if every price still rounds to the same <decimals> decimal value
+                 (float32 holds 2 decimals exactly up to ~1.3 lakh), else left as they are
+        volume : the smallest signed integer dtype that holds it (integer volumes only)
+
+    Args:
+        df (pandas dataframe): OHLCV dataframe, Eg. Stock.data
+        price_columns (tuple, optional): Defaults to ('open', 'high', 'low', 'close').
+        decimals (int, optional): Precision to preserve. Defaults to 2.
+
+    Returns:
+        compact_df (pandas dataframe)
+    """
+
+    columns = {}
+
+    for col in df.columns:
+        values = df[col].to_numpy()
+
+        if col in price_columns and values.dtype.kind == 'f' and values.dtype.itemsize > 4:
+            compact = values.astype(np.float32)
+            if np.array_equal(np.round(compact.astype(np.float64), decimals), np.round(values, decimals), equal_nan=True):
+                values = compact
+
+        elif col == 'volume' and values.dtype.kind in 'iu' and len(values):
+            values = values.astype(smallest_int_dtype(values.min(), values.max()), copy=False)
+
+        columns[col] = values
+
+    return pd.DataFrame(columns, index=df.index, copy=False)
+
+
+def smallest_int_dtype(min_value, max_value):
+    """
+    Smallest signed integer dtype that holds every value in [min_value, max_value]
+    """
+
+    for dtype in (np.int8, np.int16, np.int32, np.int64):
+        info = np.iinfo(dtype)
+        if info.min <= min_value and max_value <= info.max:
+            return np.dtype(dtype)
+
+    return np.dtype(np.int64)
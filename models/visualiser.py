@@ -1,4 +1,3 @@
-import datetime
 import os
 
 import matplotlib.patches as patches
@@ -8,6 +7,7 @@ import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 
+from resample import NS_PER_DAY, NS_PER_MIN, SESSION_OPEN_MIN, TIMEFRAMES, downsample_rows, local_ns
 from stock import Stock
 
 
@@ -115,9 +115,13 @@ class Visualiser():
         
         
     
-    def plot_priceaction(self, start_datetime, end_datetime, figsize=(40, 12)):
+    def plot_priceaction(self, start_datetime, end_datetime, figsize=(40, 12), max_candles=1000):
         """
         Plots Candle Stick chart of given data from start_datetime to end_datetime
+        
+        Long ranges are drawn at a lower level of detail : if there are more than max_candles candles,
+        the range is drawn from the smallest timeframe of Stock.resample (3, 5, ... mins, day) that fits,
+        and day bars are further merged if needed. The title shows the timeframe drawn.
 
         Args:
             start_datetime (pd.Timestamp): Starting datetime
@@ -128,30 +132,68 @@ class Visualiser():
                 end_datetime = pd.Timestamp(year=2016, month=5, day=20, hour=12, minute=20)
             
             figsize (tuple, optional): (width,height). Defaults to (40, 12)
+            max_candles (int, optional): Max num of candles drawn, None draws every candle. Defaults to 1000
         """
         
-        # Find id in the diven dataframe
-        start_idx = self.stock.get_datetime_idx(start_datetime)[0]
-        end_idx = self.stock.get_datetime_idx(end_datetime)[0]
+        # Find id in the diven dataframe, the first candle at or after start & the last at or before end
+        start_idx, end_idx = self.stock.get_datetime_positions([start_datetime, end_datetime])
+        if start_idx < 0 or self.stock.get_datetime_idx(start_datetime).size == 0:
+            start_idx += 1
         
-        # Title to display 
-        title = f'{self.stock.symbol} : {str(start_datetime)} ---> {str(end_datetime)}'
-
         # Filter data to be plotted
         data = self.stock.data.iloc[start_idx : end_idx+1, :]
+        timeframe = f'{self.stock.cdst_duration_mins} min' if self.stock.cdst_duration_days is None else 'day'
+        
+        if max_candles is not None and len(data) > max_candles:
+            data, timeframe = self._level_of_detail(data, max_candles)
+        
+        # Title to display 
+        title = f'{self.stock.symbol} : {str(start_datetime)} ---> {str(end_datetime)} [{timeframe}]'
                 
-        # Vertical lines at 9:15 [start of the day]        
+        # Vertical lines at 9:15 [start of the day], the first bar of every day of intraday bars
         vlines_list = []
-        for idx in data.index:
-            if idx.time() == datetime.time(9, 15):
-                vlines_list.append(idx)
+        if self.stock.cdst_duration_days is None and 'day' not in timeframe:
+            index_ns = local_ns(data.index)
+            day = index_ns // NS_PER_DAY
+            first_bars = np.diff(day, prepend=day[:1]) != 0
+            first_bars[:1] = index_ns[:1] - day[:1] * NS_PER_DAY == SESSION_OPEN_MIN * NS_PER_MIN    # The plot starts at 9:15
+            vlines_list = list(data.index[np.flatnonzero(first_bars)])
                 
         # Plot the candlestick chart
         mpf.plot(data,  
                 vlines = { 'vlines' : vlines_list, 'alpha':.7, 'colors':'gold', 'linewidths':5} , 
                 type='candle', style='yahoo', title=title, volume=True,
-                linecolor='black', figsize = figsize)
-                        
+                linecolor='black', figsize = figsize, warn_too_much_data=len(data)+1)
+        
+        
+    def _level_of_detail(self, data, max_candles):
+        """
+        Re-aggregates the candles of <data> (a slice of stock.data) to at most max_candles bars
+        
+        Returns:
+            bars (pandas Dataframe)
+            timeframe (str): Eg. '15 min', 'day', '5 day'
+        """
+        
+        first, last = data.index[0], data.index[-1]
+        
+        for timeframe in TIMEFRAMES:
+            
+            if timeframe != 'day' and (self.stock.cdst_duration_days is not None or timeframe % self.stock.cdst_duration_mins):
+                continue
+            
+            # Cached bars of the timeframe, from the bar holding the first candle to the one holding the last
+            bars = self.stock.resample(timeframe)
+            bars = bars.iloc[bars.index.searchsorted(first, side='right') - 1 : bars.index.searchsorted(last, side='right')]
+            
+            if len(bars) <= max_candles:
+                return bars, (f'{timeframe} min' if timeframe != 'day' else 'day')
+        
+        # Even day bars are too many, merge consecutive days
+        factor = -(-len(bars) // max_candles)
+        
+        return downsample_rows(bars, factor), f'{factor} day'
+        
         
         
     def plot2candles(self, target_datetime1, target_datetime2):
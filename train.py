@@ -1,43 +1,72 @@
+import os
+import sys
+
 import numpy as np
-import pandas as pd
-from gensim.models import Word2Vec
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models'))
+
+import instrument
+from corpus import WindowCorpus
+from embeddings import EmbeddingStore
+from instrument import span
+from stock import Stock
+from tokenizer import CandleTokenizer
+from training import load_checkpoint_meta, save_checkpoint, train_word2vec, update_word2vec
 
 # Load OHLC data from a CSV file
-# The CSV file should have columns: ['timestamp', 'open', 'high', 'low', 'close']
-df = pd.read_csv('ohlc_data.csv')
+# The CSV file should have columns: ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+# Every stage is timed (wall time, rows/sec, peak RSS), the spans are written to SPANS_PATH at the end
+# For a deep dive : instrument.configure(profile_dir='./profiles', trace_memory=True)
+CSV_PATH = 'ohlc_data.csv'
+MODEL_PATH = 'word2vec_ohlc.model'
+VECTORS_PATH = 'word2vec_ohlc.vectors'      # Memory mapped vectors for serving, see models/embeddings.py
+SPANS_PATH = 'train_spans.json'
+
+# With a saved model (& its MODEL_PATH.meta.json), only the windows after the data range it covers are
+# trained on, plus a replay sample of REPLAY_FRACTION old windows per new one. False retrains from scratch.
+INCREMENTAL = True
+REPLAY_FRACTION = 0.1
 
-# Preprocessing: Calculate price movements as a sequence of directional changes
-# Here we represent movements as 'up', 'down', or 'flat'
-def calculate_movement(open_price, close_price):
-    if close_price > open_price:
-        return 'up'
-    elif close_price < open_price:
-        return 'down'
-    else:
-        return 'flat'
+stock = Stock(CSV_PATH)
 
-df['movement'] = df.apply(lambda row: calculate_movement(row['open'], row['close']), axis=1)
+# Preprocessing: Quantize every candle into a token of the candle vocabulary
+# A token is the direction ('up', 'down', 'flat') with the size bins of body, head & tail
+tokenizer = CandleTokenizer()
 
 # Create sequences of movements
-# Group movements into sequences of a specific length (e.g., 10 movements per sequence)
+# Windows of a specific length (e.g., 10 movements per sequence) within a trading day,
+# they are cut out of the token array lazily on every pass gensim makes over the corpus
 sequence_length = 10
-sequences = []
-
-for i in range(len(df) - sequence_length):
-    sequence = df['movement'].iloc[i:i + sequence_length].tolist()
-    sequences.append(sequence)
+with span('train.corpus', rows=len(stock.data)):
+    sequences = WindowCorpus.from_stock(stock, tokenizer, window=sequence_length)
+token_ids = sequences.token_ids
 
 # Train Word2Vec model
-model = Word2Vec(sentences=sequences, vector_size=50, window=5, min_count=1, sg=1, workers=4)
+# The corpus is streamed to a text file & trained in gensim's corpus_file mode, on all cores
+if INCREMENTAL and load_checkpoint_meta(MODEL_PATH) is not None:
+    with span('train.word2vec_update', rows=len(sequences)):
+        model, epoch_stats = update_word2vec(MODEL_PATH, sequences, replay_fraction=REPLAY_FRACTION)
+
+else:
+    with span('train.word2vec', rows=len(sequences)):
+        model, epoch_stats = train_word2vec(sequences, vector_size=50, window=5, min_count=1, sg=1)
+
+    # Save the model for later use, with the data range it covers
+    with span('train.save'):
+        save_checkpoint(model, MODEL_PATH, sequences, mode='full', epochs=model.epochs)
 
-# Save the model for later use
-model.save("word2vec_ohlc.model")
+# Export the vectors in token id order, serving processes open them with EmbeddingStore(VECTORS_PATH)
+with span('train.export_vectors'):
+    EmbeddingStore.export(model, VECTORS_PATH, tokenizer.token_names)
 
-# Example: Get the vector for a movement
-movement_vector = model.wv['up']
-print(f"Vector for 'up': {movement_vector}")
+instrument.print_summary()
+instrument.export_json(SPANS_PATH)
 
-# Example: Find the most similar movements to 'up'
-similar_movements = model.wv.most_similar('up', topn=3)
-print(f"Most similar movements to 'up': {similar_movements}")
+# Example: Get the vector for the most frequent candle
+token = tokenizer.token_names[np.bincount(token_ids).argmax()]
+movement_vector = model.wv[token]
+print(f"Vector for '{token}': {movement_vector}")
 
+# Example: Find the most similar candles to it
+similar_movements = model.wv.most_similar(token, topn=3)
+print(f"Most similar movements to '{token}': {similar_movements}")